@@ -0,0 +1,41 @@
+"""Measure the cold import cost of the models module.
+
+Each sample imports models in a fresh interpreter, the way a Lambda cold
+start does. Run it on two revisions to compare them :
+
+    PYTHONPATH=src:. python benchmarks/cold_start.py --runs 20
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+SNIPPET = """
+import time
+start = time.perf_counter()
+import models
+print(time.perf_counter() - start)
+"""
+
+
+def sample():
+    output = subprocess.run(
+        [sys.executable, "-c", SNIPPET], check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    samples = sorted(sample() for _ in range(args.runs))
+    print(f"runs:   {args.runs}")
+    print(f"median: {statistics.median(samples) * 1000:.1f} ms")
+    print(f"min:    {samples[0] * 1000:.1f} ms")
+    print(f"max:    {samples[-1] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Seed the balloons tables with synthetic balloons and tags.
+
+    PYTHONPATH=src:. python benchmarks/dataset.py --balloons 1000000 --tags 50000
+
+Balloons are spread over the tags combinations with a long tail, the way
+real traffic is, and every counter gets the last_balloon new balloons are
+paired with. Point AWS_ENDPOINT_URL to a DynamoDB stand-in such as DynamoDB
+Local, without it this seeds moto in memory, which is only useful from
+benchmarks.load.
+"""
+import argparse
+import random
+from datetime import datetime, timezone
+
+from benchmarks import environment
+
+WORDS = "fr es de ru music art love travel books cinema food night sea city".split()
+
+
+def tags_combinations(count, rng):
+    combinations = set()
+    while len(combinations) < count:
+        size = rng.choice([1, 1, 1, 2, 2, 3])
+        tags = rng.sample(WORDS, size)
+        combinations.add(
+            " ".join(sorted(f"{tag}{rng.randrange(count)}" for tag in tags))
+        )
+    return sorted(combinations)
+
+
+def seed(balloons: int, tags: int, seed: int = 0):
+    import models
+
+    rng = random.Random(seed)
+    combinations = tags_combinations(tags, rng)
+    weights = [1 / (rank + 1) for rank in range(len(combinations))]
+    now = datetime.now(timezone.utc).isoformat()
+
+    counts = {}
+    for combination in rng.choices(combinations, weights, k=balloons):
+        counts[combination] = counts.get(combination, 0) + 1
+
+    with models.balloons_table.batch_writer() as balloons_batch, (
+        models.balloons_seq_table.batch_writer()
+    ) as seq_batch, models.tag_index_table.batch_writer() as index_batch:
+        for combination, count in counts.items():
+            for seq in range(1, count + 1):
+                balloon = {
+                    "id": f"telegram {seq} {rng.randrange(10 ** 9)}",
+                    "user_id": f"telegram {rng.randrange(10 ** 6)}",
+                    "text": "Seeded balloon " + "x" * rng.randrange(40, 400),
+                    "sender_display_name": "Seed",
+                    "tags": combination,
+                    "seq": seq,
+                    "datetime": now,
+                    "raw": {},
+                }
+                balloons_batch.put_item(Item=balloon)
+
+            seq_batch.put_item(
+                Item={
+                    "tags": combination,
+                    "seq": count,
+                    "last_message": now,
+                    "last_message_day": now[:10],
+                    "last_balloon": {
+                        key: value
+                        for key, value in balloon.items()
+                        if key not in ("seq", "raw")
+                    },
+                }
+            )
+            for tag in combination.split(" "):
+                index_batch.put_item(
+                    Item={"tag": tag, "tags": combination, "last_message": now}
+                )
+
+    return combinations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--balloons", type=int, default=100000)
+    parser.add_argument("--tags", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    environment.setup()
+    seed(args.balloons, args.tags, args.seed)
+
+
+if __name__ == "__main__":
+    main()
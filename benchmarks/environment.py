@@ -0,0 +1,53 @@
+"""In-process environment of the benchmarks.
+
+DynamoDB is moto's in-memory implementation, unless AWS_ENDPOINT_URL points
+to another stand-in such as DynamoDB Local. Telegram and the Graph API are
+answered by benchmarks.fakes.
+"""
+import logging
+import os
+
+SECRETS = {
+    "DEV_TELEGRAM_TOKEN": "0:benchmark",
+    "DEV_FB_APP_SECRET": "benchmark",
+    "DEV_FB_PAGE_TOKEN": "benchmark",
+    "DEV_FB_VERIFY_TOKEN": "benchmark",
+    "AWS_ACCESS_KEY_ID": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+    "AWS_DEFAULT_REGION": "eu-west-3",
+}
+
+
+def setup():
+    for key, value in SECRETS.items():
+        os.environ.setdefault(key, value)
+
+    if "AWS_ENDPOINT_URL" not in os.environ:
+        try:
+            # moto 4, pinned in the Pipfile for Python 3.7
+            from moto import mock_dynamodb
+        except ImportError:
+            # moto 5 mocks every service with one decorator
+            from moto import mock_aws as mock_dynamodb
+
+        mock_dynamodb().start()
+
+    from benchmarks import fakes
+
+    fakes.install_dynamodb_counter()
+
+    import layers.sessions
+    import models
+    import schema
+
+    logging.getLogger().setLevel(logging.WARNING)
+    schema.main([])
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("layers.tracing").propagate = False
+    fakes.dynamodb_calls.clear()
+
+    adapter = fakes.FakePlatformAdapter()
+    for platform in (models.APP_TELEGRAM, models.APP_MESSENGER):
+        layers.sessions.get(platform).mount("https://", adapter)
+
+    return adapter
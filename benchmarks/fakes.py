@@ -0,0 +1,111 @@
+"""Platform stand-ins for the benchmarks.
+
+FakePlatformAdapter answers Telegram Bot API and Graph API calls in process,
+it is mounted on the pooled sessions of layers.sessions. Call counters are
+plain module-level Counters, read as deltas around each request.
+"""
+import json
+import threading
+from collections import Counter
+from itertools import count
+from urllib.parse import parse_qsl, urlparse
+
+from requests import Response
+from requests.adapters import BaseAdapter
+
+http_calls = Counter()
+dynamodb_calls = Counter()
+_lock = threading.Lock()
+_ids = count(1)
+
+
+def count_dynamodb_call(model, **kwargs):
+    with _lock:
+        dynamodb_calls[model.name] += 1
+
+
+def install_dynamodb_counter():
+    """Count DynamoDB calls of every client created from now on."""
+    import boto3
+
+    boto3.setup_default_session()
+    boto3.DEFAULT_SESSION.events.register("before-call.dynamodb", count_dynamodb_call)
+
+
+class FakePlatformAdapter(BaseAdapter):
+    """Telegram and Graph API endpoints, recording what was sent."""
+
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def request_data(self, request):
+        if not request.body:
+            return {}
+        body = request.body
+        if isinstance(body, bytes):
+            body = body.decode()
+        if request.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(body)
+        return dict(parse_qsl(body))
+
+    def messenger_send(self, data):
+        message_id = f"m_{next(_ids)}"
+        self.sent.append(("send", data, message_id))
+        return {"recipient_id": data["recipient"]["id"], "message_id": message_id}
+
+    def answer(self, request):
+        url = urlparse(request.url)
+        data = self.request_data(request)
+
+        if url.netloc == "api.telegram.org":
+            method = url.path.rsplit("/", 1)[1]
+            if method == "sendMessage":
+                message_id = next(_ids)
+                self.sent.append((method, data, message_id))
+                return (
+                    method,
+                    {
+                        "ok": True,
+                        "result": {
+                            "message_id": message_id,
+                            "chat": {"id": int(data["chat_id"])},
+                        },
+                    },
+                )
+            return method, {"ok": True, "result": True}
+
+        if url.path.endswith("/me/messages"):
+            if "message" not in data:
+                return "sender_action", {"recipient_id": data["recipient"]["id"]}
+            return "send", self.messenger_send(data)
+
+        if "batch" in data:
+            responses = []
+            for request in json.loads(data["batch"]):
+                body = {
+                    key: json.loads(value) for key, value in parse_qsl(request["body"])
+                }
+                responses.append(
+                    {"code": 200, "body": json.dumps(self.messenger_send(body))}
+                )
+            return "batch", responses
+
+        return "profile", {"first_name": "Ada"}
+
+    def send(self, request, **kwargs):
+        method, body = self.answer(request)
+
+        with _lock:
+            http_calls[method] += 1
+
+        response = Response()
+        response.status_code = 200
+        response._content = json.dumps(body).encode()
+        response.headers["Content-Type"] = "application/json"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,164 @@
+"""Report the size of stored balloons in each BALLOON_RAW format.
+
+    PYTHONPATH=src:. python benchmarks/item_size.py --balloons 10000
+
+Balloons with Telegram and Messenger payloads like the webhooks send are
+encoded as the balloons table stores them, the previous full item included,
+and sized with the DynamoDB item size rules. Write units assume standard
+writes of 1 KB, read units strongly consistent reads of 4 KB.
+"""
+import argparse
+import math
+import random
+import time
+from decimal import Decimal
+
+from benchmarks import environment
+
+FORMATS = ["full", "compressed", "drop"]
+WORDS = "hello stranger balloon sea night city music love travel books".split()
+
+
+def attribute_size(value) -> int:
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (int, float, Decimal)):
+        digits = len(str(abs(value)).replace(".", "").strip("0")) or 1
+        return math.ceil(digits / 2) + 1
+    if isinstance(value, dict):
+        return 3 + sum(
+            len(key.encode()) + attribute_size(item) + 1 for key, item in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return 3 + sum(attribute_size(item) + 1 for item in value)
+    raise TypeError(value)
+
+
+def item_size(item: dict) -> int:
+    return sum(len(key.encode()) + attribute_size(value) for key, value in item.items())
+
+
+def telegram_raw(rng, user, text):
+    return {
+        "message_id": rng.randrange(10**6),
+        "from": {
+            "id": user,
+            "is_bot": False,
+            "first_name": "Ada",
+            "last_name": "Lovelace",
+            "username": f"ada{user}",
+            "language_code": "fr",
+        },
+        "chat": {
+            "id": user,
+            "first_name": "Ada",
+            "last_name": "Lovelace",
+            "username": f"ada{user}",
+            "type": "private",
+        },
+        "date": int(time.time()),
+        "text": text,
+        "entities": [
+            {
+                "offset": text.index("#"),
+                "length": len(text) - text.index("#"),
+                "type": "hashtag",
+            }
+        ]
+        if "#" in text
+        else [],
+    }
+
+
+def messenger_raw(rng, user, text):
+    return {
+        "sender": {"id": str(user)},
+        "recipient": {"id": "104857600000000"},
+        "timestamp": int(time.time() * 1000),
+        "message": {
+            "mid": f"m_{rng.getrandbits(256):064x}",
+            "text": text,
+            "nlp": {"intents": [], "entities": {}, "traits": {}},
+        },
+    }
+
+
+def messages(messages_module, count, seed=0):
+    rng = random.Random(seed)
+    for i in range(count):
+        user = rng.randrange(10**9)
+        text = " ".join(rng.choices(WORDS, k=rng.randrange(5, 60)))
+        text = text + rng.choice(["", " #fr", " #music #fr", " #books"])
+        if rng.random() < 0.7:
+            raw = telegram_raw(rng, user, text)
+            message_id = f"telegram {user} {raw['message_id']}"
+            user_id = f"telegram {user}"
+        else:
+            raw = messenger_raw(rng, user, text)
+            message_id = f"messenger {raw['message']['mid']}"
+            user_id = f"messenger {user}"
+
+        message = messages_module.IncomingMessage(
+            id=message_id,
+            user_id=user_id,
+            text=text,
+            raw=raw,
+            sender_display_name="Ada",
+        )
+        message.seq = rng.randrange(1, 10**6)
+        yield message
+
+
+def previous_item(message) -> dict:
+    """Balloon item as stored before, the whole message."""
+    return {
+        "id": message.id,
+        "user_id": message.user_id,
+        "text": message.text,
+        "raw": message.raw,
+        "datetime": message.datetime,
+        "tags": message.partition,
+        "seq": message.seq,
+        "shard": message.shard,
+        "sender_display_name": message.sender_display_name,
+        "reply_to": message.reply_to,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--balloons", type=int, default=10000)
+    args = parser.parse_args()
+
+    environment.setup()
+
+    import layers.messages
+
+    # the item as stored before, the whole message
+    sizes = {"previous": []}
+    for message in messages(layers.messages, args.balloons):
+        sizes["previous"].append(item_size(previous_item(message)))
+
+    for storage in FORMATS:
+        layers.messages.BALLOON_RAW = storage
+        sizes[storage] = [
+            item_size(message.to_balloon_item())
+            for message in messages(layers.messages, args.balloons)
+        ]
+
+    print(f"{args.balloons} balloons\n")
+    print(f"{'format':<12}{'avg bytes':>11}{'max bytes':>11}{'WCU':>7}{'RCU':>7}")
+    for storage, samples in sizes.items():
+        print(
+            f"{storage:<12}{sum(samples) / len(samples):>11.0f}{max(samples):>11}"
+            f"{sum(math.ceil(size / 1024) for size in samples) / len(samples):>7.2f}"
+            f"{sum(math.ceil(size / 4096) for size in samples) / len(samples):>7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
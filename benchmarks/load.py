@@ -0,0 +1,266 @@
+"""Replay synthetic webhooks through layers.handlers.handle.
+
+    PYTHONPATH=src:. python benchmarks/load.py --requests 2000 --seed-balloons 10000
+
+Telegram updates and signed Messenger webhooks cover new balloons, replies,
+postbacks, trending and long tags buttons. The report gives latency
+percentiles and throughput, and the DynamoDB and HTTP calls made per request
+on each path, which is what regressions show up in first.
+"""
+import argparse
+import hmac
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+from itertools import count
+
+from benchmarks import environment, fakes
+
+logger = logging.getLogger(__name__)
+
+LONG_TEXT = "Hello stranger, this is a message long enough to be sent as a balloon. "
+LONG_TAGS = " ".join(f"#averyveryverylongtag{i}" for i in range(4))
+TAGS = ["", "#fr", "#music", "#fr #music", "#es", "#books"]
+
+_ids = count(1)
+
+
+def telegram_request(update):
+    update = {"update_id": next(_ids), **update}
+    return {
+        "resource": "/telegram",
+        "headers": {},
+        "queryStringParameters": None,
+        "body": json.dumps(update),
+    }
+
+
+def telegram_message(user, text, **extra):
+    return telegram_request(
+        {
+            "message": {
+                "message_id": next(_ids),
+                "from": {"id": user, "first_name": "Ada"},
+                "chat": {"id": user},
+                "date": int(time.time()),
+                "text": text,
+                **extra,
+            }
+        }
+    )
+
+
+def telegram_callback(user, data):
+    return telegram_request(
+        {
+            "callback_query": {
+                "id": str(next(_ids)),
+                "from": {"id": user, "first_name": "Ada"},
+                "data": data,
+            }
+        }
+    )
+
+
+def messenger_request(user, event):
+    from settings import FB_APP_SECRET
+
+    body = json.dumps(
+        {
+            "object": "page",
+            "entry": [
+                {
+                    "id": "page",
+                    "time": int(time.time() * 1000),
+                    "messaging": [
+                        {
+                            "sender": {"id": str(user)},
+                            "recipient": {"id": "page"},
+                            "timestamp": int(time.time() * 1000),
+                            **event,
+                        }
+                    ],
+                }
+            ],
+        }
+    )
+    signature = hmac.new(
+        FB_APP_SECRET.encode(), body.encode("raw-unicode-escape"), "sha1"
+    ).hexdigest()
+    return {
+        "resource": "/facebook-messenger",
+        "headers": {"X-Hub-Signature": f"sha1={signature}"},
+        "queryStringParameters": None,
+        "body": body,
+    }
+
+
+def messenger_message(user, text):
+    return messenger_request(
+        user, {"message": {"mid": f"mid.{next(_ids)}", "text": text}}
+    )
+
+
+def messenger_postback(user, payload):
+    return messenger_request(user, {"postback": {"title": "", "payload": payload}})
+
+
+class Scenarios:
+    """Each scenario returns the (path, request) list of one user action."""
+
+    def __init__(self, adapter, rng, users):
+        self.adapter = adapter
+        self.rng = rng
+        self.users = users
+        self.replied = set()
+
+    def user(self):
+        return self.rng.randrange(self.users) + 1
+
+    def new_balloon(self):
+        user = self.user()
+        text = f"{LONG_TEXT}{self.rng.choice(TAGS)}"
+        return [
+            ("command", telegram_message(user, "/new_balloon")),
+            ("new_balloon", telegram_message(user, text)),
+        ]
+
+    def long_tags(self):
+        user = self.user()
+        return [
+            ("command", telegram_message(user, "/new_balloon")),
+            ("long_tags", telegram_message(user, f"{LONG_TEXT}{LONG_TAGS}")),
+        ]
+
+    def messenger_new_balloon(self):
+        user = self.user()
+        text = f"{LONG_TEXT}{self.rng.choice(TAGS)}"
+        return [
+            ("postback", messenger_postback(user, "new_balloon")),
+            ("messenger_new_balloon", messenger_message(user, text)),
+        ]
+
+    def reply(self):
+        # answer a balloon delivered to a Telegram chat, through the reply feature
+        for method, data, message_id in reversed(self.adapter.sent):
+            if (
+                method == "sendMessage"
+                and "Start a conversation" in data.get("reply_markup", "")
+                and message_id not in self.replied
+            ):
+                self.replied.add(message_id)
+                user = int(data["chat_id"])
+                return [
+                    (
+                        "reply",
+                        telegram_message(
+                            user,
+                            "Thanks for your balloon!",
+                            reply_to_message={
+                                "message_id": message_id,
+                                "chat": {"id": user},
+                            },
+                        ),
+                    )
+                ]
+        return self.new_balloon()
+
+    def postback(self):
+        if self.rng.random() < 0.5:
+            return [("postback", telegram_callback(self.user(), "help"))]
+        return [("postback", messenger_postback(self.user(), "help"))]
+
+    def trending(self):
+        return [("trending", telegram_message(self.user(), "/trending"))]
+
+    def pick(self):
+        return self.rng.choices(
+            [
+                self.new_balloon,
+                self.long_tags,
+                self.messenger_new_balloon,
+                self.reply,
+                self.postback,
+                self.trending,
+            ],
+            [40, 5, 15, 15, 15, 10],
+        )[0]()
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def run(requests, users, seed_balloons, seed_tags):
+    adapter = environment.setup()
+
+    from layers.handlers import handle
+
+    if seed_balloons:
+        from benchmarks import dataset
+
+        dataset.seed(seed_balloons, seed_tags)
+
+    scenarios = Scenarios(adapter, random.Random(0), users)
+    latencies = defaultdict(list)
+    dynamodb_calls = defaultdict(int)
+    http_calls = defaultdict(int)
+    failures = defaultdict(int)
+
+    start = time.perf_counter()
+    done = 0
+    while done < requests:
+        for path, request in scenarios.pick():
+            dynamodb_before = sum(fakes.dynamodb_calls.values())
+            http_before = sum(fakes.http_calls.values())
+
+            request_start = time.perf_counter()
+            try:
+                response = handle(request)
+            except Exception:
+                logger.exception("Failed to handle %s", path)
+                response = {"statusCode": 500}
+            latencies[path].append(time.perf_counter() - request_start)
+
+            dynamodb_calls[path] += sum(fakes.dynamodb_calls.values()) - dynamodb_before
+            http_calls[path] += sum(fakes.http_calls.values()) - http_before
+            if response["statusCode"] != 200:
+                failures[path] += 1
+            done = done + 1
+    elapsed = time.perf_counter() - start
+
+    print(f"{done} requests in {elapsed:.2f} s, {done / elapsed:.1f} requests/s\n")
+    print(
+        f"{'path':<24}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        f"{'ddb/req':>9}{'http/req':>9}{'errors':>8}"
+    )
+    for path, samples in sorted(latencies.items()):
+        print(
+            f"{path:<24}{len(samples):>7}"
+            f"{percentile(samples, 50) * 1000:>9.2f}"
+            f"{percentile(samples, 95) * 1000:>9.2f}"
+            f"{percentile(samples, 99) * 1000:>9.2f}"
+            f"{dynamodb_calls[path] / len(samples):>9.2f}"
+            f"{http_calls[path] / len(samples):>9.2f}"
+            f"{failures[path]:>8}"
+        )
+    print(f"\nDynamoDB calls: {dict(fakes.dynamodb_calls)}")
+    print(f"HTTP calls: {dict(fakes.http_calls)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--seed-balloons", type=int, default=0)
+    parser.add_argument("--seed-tags", type=int, default=1000)
+    args = parser.parse_args()
+
+    run(args.requests, args.users, args.seed_balloons, args.seed_tags)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Measure the model layer of a request: parsing, item encoding and decoding.
+
+    PYTHONPATH=src:. python benchmarks/models_codec.py
+
+The per-request work on models (a Telegram update parsed into a message, the
+user decoded and its question encoded, the balloon encoded for put_item) is
+run with the slotted models, and with dataclasses encoded by
+dataclasses.asdict as they were before, for reference. Peak allocations are
+measured with tracemalloc, CPU time without it.
+"""
+import argparse
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from time import process_time
+from typing import Optional
+
+from benchmarks import environment
+
+UPDATE = {
+    "message_id": 1234,
+    "from": {"id": 42, "is_bot": False, "first_name": "Ada", "language_code": "en"},
+    "chat": {"id": 42, "first_name": "Ada", "type": "private"},
+    "date": 1600000000,
+    "text": "Hello stranger, this is a message long enough to be a balloon #fr",
+    "entities": [{"offset": 62, "length": 3, "type": "hashtag"}],
+}
+
+USER_ITEM = {
+    "id": "telegram 42",
+    "created": "2020-09-13T12:26:40+00:00",
+    "balloons_updated": "2020-09-13T12:26:40+00:00",
+    "balloons": 5,
+    "question": {"name": "new_balloon", "params": None},
+    "first_balloon": True,
+    "display_name": None,
+    "display_name_updated": None,
+}
+
+
+def asddbdict(instance):
+    return asdict(
+        instance,
+        dict_factory=lambda tuples: {
+            key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in tuples
+        },
+    )
+
+
+@dataclass
+class DataclassQuestion:
+    name: str
+    params: Optional[dict] = None
+
+
+@dataclass
+class DataclassUser:
+    id: str
+    created: datetime
+    balloons_updated: datetime
+    balloons: int = 5
+    question: Optional[DataclassQuestion] = None
+    first_balloon: bool = False
+    display_name: Optional[str] = None
+    display_name_updated: Optional[datetime] = None
+
+    def __post_init__(self):
+        if isinstance(self.question, dict):
+            self.question = DataclassQuestion(**self.question)
+        if isinstance(self.created, str):
+            self.created = datetime.fromisoformat(self.created)
+        if isinstance(self.balloons_updated, str):
+            self.balloons_updated = datetime.fromisoformat(self.balloons_updated)
+
+
+@dataclass
+class DataclassMessage:
+    id: Optional[str]
+    user_id: str
+    text: str
+    raw: dict
+    sender_display_name: str
+    reply_to: Optional[str] = None
+    datetime: str = field(
+        default_factory=lambda: datetime.now(timezone.utc).isoformat()
+    )
+    tags: str = ""
+    seq: Optional[int] = None
+    shard: int = 0
+
+
+def dataclass_request():
+    message = DataclassMessage(
+        id=f"telegram {UPDATE['chat']['id']} {UPDATE['message_id']}",
+        user_id=f"telegram {UPDATE['from']['id']}",
+        text=UPDATE["text"],
+        raw=UPDATE,
+        sender_display_name=UPDATE["from"]["first_name"],
+        tags="fr",
+        seq=1,
+    )
+    user = DataclassUser(**USER_ITEM)
+    asddbdict(user.question)
+    return asddbdict(message)
+
+
+def slotted_request(models, messages):
+    message = messages.IncomingMessage(
+        id=f"telegram {UPDATE['chat']['id']} {UPDATE['message_id']}",
+        user_id=f"telegram {UPDATE['from']['id']}",
+        text=UPDATE["text"],
+        raw=UPDATE,
+        sender_display_name=UPDATE["from"]["first_name"],
+    )
+    message.seq = 1
+    user = models.User.from_item(USER_ITEM)
+    user.question.to_item()
+    return message.to_balloon_item()
+
+
+def allocated(request):
+    """Peak memory allocated by one request, in bytes."""
+    # warm up first, restarting clears the traces (no reset_peak before 3.9)
+    request()
+    tracemalloc.start()
+    request()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def cpu(request, requests):
+    """CPU time of one request, in seconds."""
+    start = process_time()
+    for i in range(requests):
+        request()
+    return (process_time() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    environment.setup()
+
+    import layers.messages
+    import models
+
+    # the payload as the dataclasses store it, compression is item_size's concern
+    layers.messages.BALLOON_RAW = "full"
+
+    print(f"{'models':<14}{'bytes/request':>14}{'µs/request':>12}")
+    for name, request in [
+        ("dataclasses", dataclass_request),
+        ("slotted", lambda: slotted_request(models, layers.messages)),
+    ]:
+        print(
+            f"{name:<14}{allocated(request):>14}"
+            f"{cpu(request, args.requests) * 1e6:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
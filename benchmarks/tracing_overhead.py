@@ -0,0 +1,90 @@
+"""Check that per-request tracing stays cheap enough for production.
+
+    PYTHONPATH=src:. python benchmarks/tracing_overhead.py
+
+Commands, postbacks and trending requests go through layers.handlers.handle
+on the benchmark fakes, each one twice, with TRACING on and off. The script
+exits with an error if a traced request is more than --max-overhead
+microseconds slower than the same untraced one, in median.
+"""
+import argparse
+import logging
+import random
+import statistics
+import sys
+from time import perf_counter
+
+from benchmarks import environment
+from benchmarks.load import Scenarios, telegram_message
+
+
+def actions(scenarios):
+    # repeatable actions, their requests are made anew since updates are
+    # deduplicated
+    return [
+        lambda: [("command", telegram_message(scenarios.user(), "/new_balloon"))],
+        scenarios.postback,
+        scenarios.trending,
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--max-overhead", type=float, default=300)
+    args = parser.parse_args()
+
+    adapter = environment.setup()
+
+    from layers import tracing
+    from layers.handlers import handle
+
+    # measure recording and formatting, not the log handler
+    logging.getLogger(tracing.__name__).addHandler(logging.NullHandler())
+    logging.getLogger(tracing.__name__).propagate = False
+
+    scenarios = Scenarios(adapter, random.Random(0), users=50)
+    rng = random.Random(1)
+
+    def timed(action, enabled):
+        tracing.TRACING = enabled
+        duration = 0
+        for path, request in action():
+            start = perf_counter()
+            response = handle(request)
+            duration = duration + perf_counter() - start
+            if response["statusCode"] != 200:
+                raise RuntimeError(f"{path} answered {response['statusCode']}")
+        return duration
+
+    # warm up the tables, sessions and caches first
+    for i in range(args.warmup):
+        timed(rng.choice(actions(scenarios)), True)
+
+    # each action runs twice, traced and untraced in random order, so that
+    # the difference of the pair is not the difference of the actions
+    traced = []
+    differences = []
+    for i in range(args.requests):
+        action = rng.choice(actions(scenarios))
+        order = [True, False]
+        rng.shuffle(order)
+        durations = {enabled: timed(action, enabled) for enabled in order}
+        traced.append(durations[True])
+        differences.append(durations[True] - durations[False])
+
+    overhead = statistics.median(differences) * 1e6
+
+    print(
+        f"median request {statistics.median(traced) * 1e6:.1f} µs traced, "
+        f"{overhead:+.1f} µs tracing overhead over {args.requests} pairs"
+    )
+    if overhead > args.max_overhead:
+        print(f"over the {args.max_overhead:.0f} µs budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,41 @@
+"""Recognize platform updates delivered more than once.
+
+Telegram and Facebook redeliver an update when its webhook is slow or fails.
+Each update key is claimed once, in an in-process LRU first, then with a
+conditional put on the updates table, whose items expire after DEDUP_TTL.
+"""
+import time
+
+from botocore.exceptions import ClientError
+
+import models
+from layers.cache import TTLCache
+from settings import DEDUP_CACHE_SIZE, DEDUP_TTL
+
+seen = TTLCache(maxsize=DEDUP_CACHE_SIZE, ttl=DEDUP_TTL)
+
+
+def claim(key: str) -> bool:
+    """Return True the first time `key` is claimed, False for a duplicate."""
+    if key in seen:
+        return False
+
+    try:
+        models.updates_table.put_item(
+            Item={"id": key, "expires": int(time.time()) + DEDUP_TTL},
+            ConditionExpression="attribute_not_exists(id)",
+        )
+    except ClientError as e:
+        if not e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            raise e
+        seen.set(key, True)
+        return False
+
+    seen.set(key, True)
+    return True
+
+
+def release(key: str):
+    """Forget a key whose update failed, so that a redelivery is handled."""
+    seen.delete(key)
+    models.updates_table.delete_item(Key={"id": key})
@@ -0,0 +1,46 @@
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from layers import tracing
+from settings import DEFERRED_WORKERS
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=DEFERRED_WORKERS)
+
+# outcome counters of deferred calls, by function name
+stats = Counter()
+_stats_lock = threading.Lock()
+
+
+class Deferred:
+    """Non-essential side effects of a request.
+
+    Calls start right away in a background thread and run while the request
+    goes on. `flush` waits for them before the request ends (a Lambda is frozen
+    as soon as it returns). Failures are logged and counted, never raised.
+    """
+
+    def __init__(self):
+        self._futures = []
+
+    def defer(self, fn, *args, **kwargs):
+        future = _executor.submit(tracing.run_in_context(fn), *args, **kwargs)
+        self._futures.append((fn.__name__, future))
+
+    def flush(self):
+        futures, self._futures = self._futures, []
+
+        for name, future in futures:
+            try:
+                future.result()
+            except Exception:
+                logger.exception("Deferred call %s failed", name)
+                outcome = "failed"
+            else:
+                outcome = "succeeded"
+
+            with _stats_lock:
+                stats[(name, outcome)] += 1
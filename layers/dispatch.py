@@ -0,0 +1,58 @@
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from layers import tracing
+from settings import DISPATCH_WORKERS, BLOCKING_WORKERS
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=DISPATCH_WORKERS)
+_blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS)
+
+
+def dispatch(
+    events: Iterable,
+    key: Callable,
+    handle: Callable,
+    executor: Optional[ThreadPoolExecutor] = None,
+) -> List[Tuple[dict, Exception]]:
+    """Run `handle` on every event over a bounded pool of workers.
+
+    Events sharing the same `key` run one after another, in the order they were
+    given. A failing event does not stop the others, the list of failed events
+    and their exceptions is returned. Callers already running in the default
+    pool pass their own `executor`.
+    """
+    groups = OrderedDict()
+    for event in events:
+        groups.setdefault(key(event), []).append(event)
+
+    def run(group):
+        failures = []
+        for event in group:
+            try:
+                handle(event)
+            except Exception as e:
+                logger.exception("Failed to handle event %s", json.dumps(event))
+                failures.append((event, e))
+        return failures
+
+    if len(groups) == 1:
+        return run(next(iter(groups.values())))
+
+    return [
+        failure
+        for failures in (executor or _executor).map(run, groups.values())
+        for failure in failures
+    ]
+
+
+async def run_blocking(fn, *args):
+    """Await a blocking call (boto3, requests) from a worker thread."""
+    return await asyncio.get_event_loop().run_in_executor(
+        _blocking_executor, tracing.run_in_context(fn), *args
+    )
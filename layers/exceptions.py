@@ -7,9 +7,21 @@ class Error(Exception):
     pass
 
 
+class UnsupportedEventError(Error, ValueError):
+    """An event the handlers can not parse, which a retry would not change."""
+
+
 class BeforeRecordError(Error):
     status = 500
 
 
 class ForbiddenError(BeforeRecordError):
     status = 403
+
+
+class DispatchError(Error):
+    """Some events of a request failed, the whole request is to be retried."""
+
+    def __init__(self, failures):
+        super().__init__(f"{len(failures)} events failed")
+        self.failures = failures
@@ -1,10 +1,13 @@
-from layers.exceptions import EarlyResponseException, BeforeRecordError
+from layers import ingest
+from layers.dispatch import run_blocking
+from layers.exceptions import EarlyResponseException, BeforeRecordError, DispatchError
+from settings import INGEST_QUEUE
 from .base import BaseMessageHandler, BaseRequestHandler
 from .messenger import MessengerRequestHandler
 from .telegram import TelegramRequestHandler
 
 
-def handle(request):
+def get_handler_class(request):
     _class = None
 
     if request["resource"].startswith("/telegram"):
@@ -13,11 +16,63 @@ def handle(request):
     if request["resource"].startswith("/facebook-messenger"):
         _class = MessengerRequestHandler
 
+    return _class
+
+
+def ok_response(body):
+    if body is None:
+        return {"statusCode": 200}
+
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": "application/json"},
+        "body": body,
+    }
+
+
+def enqueue(request):
+    """Validate a request and queue it for the worker, see layers.ingest."""
+    _class = get_handler_class(request)
+    _class().validate(request)
+    ingest.get_queue().put(request, _class.ordering_key(request))
+
+
+def process(request):
+    """Handle a request from the ingest queue.
+
+    It was validated when queued, and its webhook is already answered, so all
+    replies are sent.
+    """
+    handler = get_handler_class(request)()
+    handler.webhook_reply = False
+    handler.process(request)
+
+
+def ordering_key(request):
+    return get_handler_class(request).ordering_key(request)
+
+
+def handle(request):
     try:
-        _class().handle(request)
+        if INGEST_QUEUE:
+            enqueue(request)
+            return ok_response(None)
+        body = get_handler_class(request)().handle(request)
     except EarlyResponseException as e:
         return {"statusCode": e.status, "body": e.body}
     except BeforeRecordError as e:
         return {"statusCode": e.status}
+    except DispatchError:
+        # already logged per event, the platform delivers the request again
+        return {"statusCode": 500}
+
+    return ok_response(body)
+
+
+async def handle_async(request):
+    """`handle` for an event loop.
 
-    return {"statusCode": 200}
+    The request runs in one of the BLOCKING_WORKERS threads, so that the loop
+    is free while it waits on DynamoDB or a platform.
+    """
+    return await run_blocking(handle, request)
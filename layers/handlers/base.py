@@ -1,65 +1,140 @@
+import json
 import logging
+from concurrent.futures import Future
 from typing import Optional
 
 import callbacks
 import layers.messages
 import models
-from layers.senders import send_message
+from layers import dedup, tracing
+from layers.deferred import Deferred
+from layers.exceptions import UnsupportedEventError
+from layers.outbox import Outbox
 
 logger = logging.getLogger(__name__)
 
 
 class BaseRequestHandler:
+    def validate(self, request) -> None:
+        """Reject requests not coming from the platform, before any work."""
+
     def handle(self, request) -> None:
         raise NotImplementedError
 
+    def process(self, request) -> None:
+        """Handle a request already validated, from the ingest queue."""
+        return self.handle(request)
+
+    @classmethod
+    def ordering_key(cls, request) -> str:
+        """Requests with the same key are handled in order by the worker."""
+        return request["resource"]
+
 
 class BaseMessageHandler:
     OK_RESPONSE = {"statusCode": 200}
     FORDIDDEN_RESPONSE = {"statusCode": 403}
+    # answer with the last reply in the webhook response instead of sending it
+    webhook_reply = False
     user: models.User = None
     message: layers.messages.IncomingMessage = None
+    session: models.UserSession = None
+    writes: models.WriteBuffer = None
+    outbox: Outbox = None
+    deferred: Deferred = None
 
     def get_message(self) -> layers.messages.IncomingMessage:
         raise NotImplementedError
 
+    def get_update_key(self) -> Optional[str]:
+        """Key identifying the update across redeliveries, see layers.dedup."""
+        return None
+
     def get_user(self):
-        res = models.users_table.get_item(Key={"id": self.message.user_id})
-        if "Item" in res:
-            user = models.User(**res["Item"])
-        else:
-            user = models.User(id=self.message.user_id)
-            models.users_table.put_item(
-                Item=models.asddbdict(models.User(id=self.message.user_id))
+        # plain text answers the pending question, which is cleared on load
+        user = models.load_user(
+            self.message.user_id,
+            clear_question=not isinstance(
+                self.message,
+                (layers.messages.ButtonCallback, layers.messages.Command),
             )
+            and self.message.reply_to is None,
+        )
+        self.session = models.UserSession(user)
 
         return user
 
     def reply_message(
-        self, text: str, markdown: bool = False, buttons: Optional[list] = None
-    ) -> layers.messages.SentMessage:
+        self,
+        text: str,
+        markdown: bool = False,
+        buttons: Optional[list] = None,
+        need_id: bool = False,
+    ) -> Future:
+        """Queue a reply in the outbox, return a future of its id.
+
+        Pass `need_id` if the id is used, otherwise the reply may be sent in
+        the webhook response, where it gets no id.
+        """
         message = layers.messages.SentMessage(
             id=None, user_id=self.message.user_id, text=text, raw={}
         )
 
-        send_message(message, markdown=markdown, buttons=buttons)
-
-        return message
+        return self.outbox.enqueue(
+            message, markdown=markdown, buttons=buttons, need_id=need_id
+        )
 
     def set_question(self, question: models.Question):
         assert question.name in callbacks.text
 
-        models.users_table.update_item(
-            Key={"id": self.message.user_id},
-            UpdateExpression="SET question = :question",
-            ExpressionAttributeValues={":question": models.asddbdict(question)},
-        )
+        self.session.set("question", question)
 
     def handle(self, event):
         self.event = event
-        self.message = self.get_message()
-        self.user = self.get_user()
-
+        self.deferred = Deferred()
+        self.writes = models.WriteBuffer()
+        self.outbox = Outbox()
+
+        with tracing.trace(type(self).__name__):
+            try:
+                return self.handle_message()
+            finally:
+                self.deferred.flush()
+
+    def handle_message(self):
+        try:
+            self.message = self.get_message()
+        except UnsupportedEventError:
+            # acknowledged, the platform would deliver it again otherwise
+            logger.info("Skipping unsupported event %s", json.dumps(self.event))
+            return None
+
+        key = self.get_update_key()
+        if key is not None and not dedup.claim(key):
+            logger.info("Skipping duplicate update %s", key)
+            return None
+
+        try:
+            self.user = self.get_user()
+
+            try:
+                self.route()
+            except Exception:
+                self.outbox.flush()
+                raise
+
+            # the question a reply asks for is saved before the reply is sent
+            self.session.commit()
+            response = self.outbox.flush(webhook_reply=self.webhook_reply)
+            self.writes.flush()
+        except Exception:
+            if key is not None:
+                dedup.release(key)
+            raise
+
+        return response
+
+    def route(self):
         if isinstance(self.message, layers.messages.ButtonCallback) or isinstance(
             self.message, layers.messages.Command
         ):
@@ -68,18 +143,10 @@ class BaseMessageHandler:
         if self.message.reply_to is not None:
             return callbacks.text["default_reply_to"](self)
 
-        self.user = models.User(
-            **models.users_table.update_item(
-                Key={"id": self.user.id},
-                UpdateExpression="SET question = :None",
-                ExpressionAttributeValues={":None": None},
-                ReturnValues="ALL_OLD",
-            )["Attributes"]
-        )
+        # the question was cleared when the user was loaded
+        question, self.user.question = self.user.question, None
 
-        if self.user.question is not None:
-            return callbacks.text[self.user.question.name](
-                self, **(self.user.question.params or dict())
-            )
+        if question is not None:
+            return callbacks.text[question.name](self, **(question.params or dict()))
 
         return callbacks.text["default"](self)
@@ -1,26 +1,83 @@
 import hmac
 import json
 import logging
+from datetime import datetime, timezone, timedelta
 
-import requests
 from requests import HTTPError
 
 import layers.messages
+import layers.sessions
 import models
-from layers.exceptions import ForbiddenError, EarlyResponseException
+from layers.cache import TTLCache
+from layers.dispatch import dispatch
+from layers.exceptions import (
+    DispatchError,
+    EarlyResponseException,
+    ForbiddenError,
+    UnsupportedEventError,
+)
 from layers.handlers import BaseMessageHandler, BaseRequestHandler
-from settings import FB_VERIFY_TOKEN, FB_APP_SECRET, FB_PAGE_TOKEN
+from settings import (
+    FB_VERIFY_TOKEN,
+    FB_APP_SECRET,
+    FB_PAGE_TOKEN,
+    DISPLAY_NAME_CACHE_SIZE,
+    DISPLAY_NAME_CACHE_TTL,
+    DISPLAY_NAME_TTL,
+)
 
 logger = logging.getLogger(__name__)
 
+display_names = TTLCache(maxsize=DISPLAY_NAME_CACHE_SIZE, ttl=DISPLAY_NAME_CACHE_TTL)
+
 
 def get_display_name(psid):
-    return requests.get(
+    session = layers.sessions.get(models.APP_MESSENGER)
+    return session.get(
         f"https://graph.facebook.com/{psid}",
         params={"access_token": FB_PAGE_TOKEN, "fields": "first_name"},
     ).json()["first_name"]
 
 
+def resolve_display_name(session: models.UserSession, psid):
+    # in-process cache first, then the name stored on the user record, and only
+    # then the Graph API, storing the result back with the user session
+    name = display_names.get(psid)
+    if name is not None:
+        return name
+
+    user = session.user
+    now = datetime.now(timezone.utc)
+    if (
+        user.display_name is not None
+        and user.display_name_updated is not None
+        and now - user.display_name_updated < timedelta(seconds=DISPLAY_NAME_TTL)
+    ):
+        name = user.display_name
+    else:
+        name = get_display_name(psid)
+        session.set("display_name", name)
+        session.set("display_name_updated", now)
+
+    display_names.set(psid, name)
+    return name
+
+
+def mark_seen(psid):
+    res = None
+    try:
+        res = layers.sessions.get(models.APP_MESSENGER).post(
+            "https://graph.facebook.com/v2.6/me/messages",
+            params={"access_token": FB_PAGE_TOKEN},
+            json={"recipient": {"id": psid}, "sender_action": "mark_seen"},
+        )
+        res.raise_for_status()
+    except HTTPError as e:
+        if res is not None:
+            logger.error(res.text)
+        raise e
+
+
 class MessengerRequestHandler(BaseRequestHandler):
     def handle_subscribe_webhook(self):
         qs = self.request["queryStringParameters"]
@@ -54,24 +111,82 @@ class MessengerRequestHandler(BaseRequestHandler):
                 )
             )
 
-    def handle(self, request):
+    def validate(self, request):
         self.request = request
         self.handle_subscribe_webhook()
         self.handle_signature_checking()
 
+    @classmethod
+    def ordering_key(cls, request):
+        for entry in json.loads(request["body"]).get("entry", []):
+            for messaging_entry in entry.get("messaging", []):
+                return f"{models.APP_MESSENGER} {messaging_entry['sender']['id']}"
+        return models.APP_MESSENGER
+
+    def get_events(self, request):
         payload = json.loads(request["body"])
 
+        # Facebook batches several entries, each with several messaging events,
+        # of which only text messages and postbacks are handled
+        events = []
         for entry in payload["entry"]:
-            MessengerMessageHandler().handle(entry)
+            for messaging_entry in entry.get("messaging", []):
+                message = messaging_entry.get("message", {})
+                if "postback" in messaging_entry or (
+                    "text" in message and not message.get("is_echo")
+                ):
+                    events.append(messaging_entry)
+                else:
+                    logger.debug(
+                        "Skipping Messenger event %s", json.dumps(messaging_entry)
+                    )
+        return events
+
+    def handle(self, request):
+        self.validate(request)
+        self.process(request)
+
+    def process(self, request):
+        # events already handled are skipped on redelivery, see get_update_key
+        failures = dispatch(
+            self.get_events(request),
+            key=lambda messaging_entry: messaging_entry["sender"]["id"],
+            handle=lambda messaging_entry: MessengerMessageHandler().handle(
+                messaging_entry
+            ),
+        )
+        if failures:
+            raise DispatchError(failures)
 
 
 class MessengerMessageHandler(BaseMessageHandler):
-    def get_message(self) -> layers.messages.IncomingMessage:
-        webhook_entry = self.event
-        if "messaging" not in webhook_entry:
-            raise ValueError
+    psid: str = None
 
-        messaging_entry = webhook_entry["messaging"][0]
+    def get_user(self):
+        user = super().get_user()
+
+        if self.message.sender_display_name is None:
+            self.message.sender_display_name = resolve_display_name(
+                self.session, self.psid
+            )
+
+        return user
+
+    def get_update_key(self):
+        messaging_entry = self.event
+        if "message" in messaging_entry:
+            return f"{models.APP_MESSENGER} {messaging_entry['message']['mid']}"
+        # postbacks have no id, the same button pressed at the same time is one
+        return "{} {} {} {}".format(
+            models.APP_MESSENGER,
+            messaging_entry["sender"]["id"],
+            messaging_entry["timestamp"],
+            messaging_entry["postback"]["payload"],
+        )
+
+    def get_message(self) -> layers.messages.IncomingMessage:
+        messaging_entry = self.event
+        self.psid = messaging_entry["sender"]["id"]
 
         if "postback" in messaging_entry:
             return layers.messages.ButtonCallback(
@@ -79,22 +194,13 @@ class MessengerMessageHandler(BaseMessageHandler):
                 user_id=models.User.generate_id(
                     app=models.APP_MESSENGER, app_id=messaging_entry["sender"]["id"]
                 ),
-                sender_display_name=get_display_name(messaging_entry["sender"]["id"]),
+                sender_display_name=None,
                 text=messaging_entry["postback"]["payload"],
                 raw=messaging_entry,
             )
 
-        if "message" not in messaging_entry:
-            logger.error(
-                "Failed to parse Messenger payload {}", json.dumps(messaging_entry)
-            )
-            raise ValueError
-
-        if "text" not in messaging_entry["message"]:
-            logger.error(
-                "Failed to parse Messenger payload {}", json.dumps(messaging_entry)
-            )
-            raise ValueError
+        if "text" not in messaging_entry.get("message", {}):
+            raise UnsupportedEventError
 
         reply_to = (
             layers.messages.Message.generate_id(
@@ -105,21 +211,7 @@ class MessengerMessageHandler(BaseMessageHandler):
             else None
         )
 
-        res = None
-        try:
-            res = requests.post(
-                "https://graph.facebook.com/v2.6/me/messages",
-                params={"access_token": FB_PAGE_TOKEN},
-                json={
-                    "recipient": {"id": messaging_entry["sender"]["id"]},
-                    "sender_action": "mark_seen",
-                },
-            )
-            res.raise_for_status()
-        except HTTPError as e:
-            if res is not None:
-                logger.error(res.text)
-            raise e
+        self.deferred.defer(mark_seen, self.psid)
 
         return layers.messages.IncomingMessage(
             id=layers.messages.IncomingMessage.generate_id(
@@ -128,7 +220,7 @@ class MessengerMessageHandler(BaseMessageHandler):
             user_id=models.User.generate_id(
                 app=models.APP_MESSENGER, app_id=messaging_entry["sender"]["id"]
             ),
-            sender_display_name=get_display_name(messaging_entry["sender"]["id"]),
+            sender_display_name=None,
             text=messaging_entry["message"]["text"],
             raw=messaging_entry,
             reply_to=reply_to,
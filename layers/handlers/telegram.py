@@ -1,19 +1,19 @@
 import json
 import logging
 
-import requests
-
 import layers.messages
+import layers.sessions
 import models
+from layers.exceptions import UnsupportedEventError
 from layers.handlers import BaseMessageHandler, BaseRequestHandler
-from settings import TELEGRAM_API
+from settings import TELEGRAM_API, TELEGRAM_WEBHOOK_REPLY
 
 logger = logging.getLogger(__name__)
 
 
 def message_model_from_telegram(telegram_object):
     if "text" not in telegram_object:
-        raise ValueError
+        raise UnsupportedEventError
 
     is_command = telegram_object["text"].startswith("/")
     _class = layers.messages.Command if is_command else layers.messages.IncomingMessage
@@ -42,15 +42,35 @@ def message_model_from_telegram(telegram_object):
     )
 
 
+def answer_callback_query(callback_query_id):
+    layers.sessions.get(models.APP_TELEGRAM).post(
+        TELEGRAM_API + "answerCallbackQuery",
+        data={"callback_query_id": callback_query_id},
+    ).raise_for_status()
+
+
 class TelegramRequestHandler(BaseMessageHandler, BaseRequestHandler):
+    webhook_reply = TELEGRAM_WEBHOOK_REPLY
+    update: dict = None
+
+    @classmethod
+    def ordering_key(cls, request):
+        update = json.loads(request["body"])
+        for kind in ("message", "edited_message"):
+            if kind in update:
+                return f"{models.APP_TELEGRAM} {update[kind]['chat']['id']}"
+        if "callback_query" in update:
+            return f"{models.APP_TELEGRAM} {update['callback_query']['from']['id']}"
+        return models.APP_TELEGRAM
+
+    def get_update_key(self):
+        return f"{models.APP_TELEGRAM} {self.update['update_id']}"
+
     def get_message(self) -> layers.messages.IncomingMessage:
-        update = json.loads(self.event["body"])
+        update = self.update = json.loads(self.event["body"])
 
         if "callback_query" in update:
-            requests.post(
-                TELEGRAM_API + "answerCallbackQuery",
-                data={"callback_query_id": update["callback_query"]["id"]},
-            )
+            self.deferred.defer(answer_callback_query, update["callback_query"]["id"])
 
             return layers.messages.ButtonCallback(
                 id=None,
@@ -61,14 +81,11 @@ class TelegramRequestHandler(BaseMessageHandler, BaseRequestHandler):
                 sender_display_name=update["callback_query"]["from"]["first_name"],
                 text=update["callback_query"]["data"],
                 raw=update["callback_query"],
-                original_message=message_model_from_telegram(
-                    update["callback_query"]["message"]
-                )
-                if "message" in update["callback_query"]
-                else None,
+                original_raw=update["callback_query"].get("message"),
+                original_parser=message_model_from_telegram,
             )
 
         if "message" not in update:
-            raise ValueError
+            raise UnsupportedEventError
 
         return message_model_from_telegram(update["message"])
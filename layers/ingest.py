@@ -0,0 +1,205 @@
+"""Work queue of ingest mode, between the webhooks and src/worker.py.
+
+A queue holds raw API Gateway requests. `take` hides the requests it returns
+until they are acknowledged with `ack`, or given back with `release` after a
+failure, up to INGEST_MAX_ATTEMPTS attempts.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import List, Tuple
+
+import boto3
+
+import models
+from settings import INGEST_MAX_ATTEMPTS, INGEST_QUEUE, INGEST_VISIBILITY_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class BaseQueue:
+    def put(self, request: dict, key: str) -> None:
+        """Queue a request, `key` groups the requests to keep in order."""
+        raise NotImplementedError
+
+    def take(self, count: int) -> List[Tuple[object, dict]]:
+        """Return up to `count` (receipt, request), oldest first."""
+        raise NotImplementedError
+
+    def ack(self, receipts: list) -> None:
+        raise NotImplementedError
+
+    def release(self, receipt) -> None:
+        raise NotImplementedError
+
+
+class MemoryQueue(BaseQueue):
+    """In-process queue, for local runs and benchmarks."""
+
+    def __init__(self):
+        self._requests = deque()
+        self._lock = threading.Lock()
+
+    def put(self, request, key):
+        with self._lock:
+            self._requests.append((request, 1))
+
+    def take(self, count):
+        with self._lock:
+            taken = []
+            while self._requests and len(taken) < count:
+                request, attempt = self._requests.popleft()
+                taken.append(((request, attempt), request))
+            return taken
+
+    def ack(self, receipts):
+        pass
+
+    def release(self, receipt):
+        request, attempt = receipt
+        if attempt >= INGEST_MAX_ATTEMPTS:
+            logger.error("Dropping request after %s attempts", attempt)
+            return
+        with self._lock:
+            self._requests.append((request, attempt + 1))
+
+
+class SQLiteQueue(BaseQueue):
+    """Queue in a SQLite file, shared by the processes of one machine."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self.connection().execute(
+            "CREATE TABLE IF NOT EXISTS requests ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "body TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "visible REAL NOT NULL DEFAULT 0)"
+        )
+
+    def connection(self) -> sqlite3.Connection:
+        # connections can not be shared between threads
+        if not hasattr(self._local, "connection"):
+            self._local.connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None
+            )
+        return self._local.connection
+
+    def put(self, request, key):
+        self.connection().execute(
+            "INSERT INTO requests (body) VALUES (?)", (json.dumps(request),)
+        )
+
+    def take(self, count):
+        connection = self.connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = connection.execute(
+                "SELECT id, body FROM requests WHERE visible <= ? ORDER BY id LIMIT ?",
+                (now, count),
+            ).fetchall()
+            connection.executemany(
+                "UPDATE requests SET visible = ?, attempts = attempts + 1 WHERE id = ?",
+                [(now + INGEST_VISIBILITY_TIMEOUT, id) for id, body in rows],
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+        return [(id, json.loads(body)) for id, body in rows]
+
+    def ack(self, receipts):
+        self.connection().executemany(
+            "DELETE FROM requests WHERE id = ?", [(id,) for id in receipts]
+        )
+
+    def release(self, receipt):
+        connection = self.connection()
+        row = connection.execute(
+            "SELECT attempts FROM requests WHERE id = ?", (receipt,)
+        ).fetchone()
+        if row is None:
+            return
+        if row[0] >= INGEST_MAX_ATTEMPTS:
+            logger.error("Dropping request %s after %s attempts", receipt, row[0])
+            connection.execute("DELETE FROM requests WHERE id = ?", (receipt,))
+            return
+        connection.execute("UPDATE requests SET visible = 0 WHERE id = ?", (receipt,))
+
+
+class SQSQueue(BaseQueue):
+    """Amazon SQS queue.
+
+    Attempts are bounded by the redrive policy of the queue, and FIFO queues
+    keep the requests of a chat in order.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.fifo = url.endswith(".fifo")
+        self.client = boto3.client("sqs", region_name=models.REGION)
+
+    def put(self, request, key):
+        body = json.dumps(request)
+        kwargs = {}
+        if self.fifo:
+            kwargs = dict(
+                MessageGroupId=key,
+                MessageDeduplicationId=hashlib.sha256(body.encode()).hexdigest(),
+            )
+        self.client.send_message(QueueUrl=self.url, MessageBody=body, **kwargs)
+
+    def take(self, count):
+        messages = self.client.receive_message(
+            QueueUrl=self.url,
+            MaxNumberOfMessages=min(count, 10),
+            VisibilityTimeout=INGEST_VISIBILITY_TIMEOUT,
+            WaitTimeSeconds=1,
+        ).get("Messages", [])
+        return [
+            (message["ReceiptHandle"], json.loads(message["Body"]))
+            for message in messages
+        ]
+
+    def ack(self, receipts):
+        for i in range(0, len(receipts), 10):
+            self.client.delete_message_batch(
+                QueueUrl=self.url,
+                Entries=[
+                    {"Id": str(j), "ReceiptHandle": receipt}
+                    for j, receipt in enumerate(receipts[i : i + 10])
+                ],
+            )
+
+    def release(self, receipt):
+        self.client.change_message_visibility(
+            QueueUrl=self.url, ReceiptHandle=receipt, VisibilityTimeout=0
+        )
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> BaseQueue:
+    """Return the queue configured by INGEST_QUEUE."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                if INGEST_QUEUE == "memory":
+                    _queue = MemoryQueue()
+                elif INGEST_QUEUE.startswith("sqlite:"):
+                    _queue = SQLiteQueue(INGEST_QUEUE[len("sqlite:") :])
+                elif INGEST_QUEUE.startswith("https://"):
+                    _queue = SQSQueue(INGEST_QUEUE)
+                else:
+                    raise ValueError(f"Unknown INGEST_QUEUE {INGEST_QUEUE}")
+    return _queue
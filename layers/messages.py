@@ -1,48 +1,118 @@
-from dataclasses import dataclass, field
+import json
+import zlib
 from datetime import datetime, timezone
-from typing import Optional, Any
+from typing import Any, Callable, Optional
 
 from botocore.exceptions import ClientError
 
-from models import balloons_seq_table
+import shards
+from models import balloons_seq_table, balloons_table
+from settings import BALLOON_RAW
+
+_UNPARSED = object()
+TRAILING_PUNCTUATION = ".,;:!?…)]}\"'»”’"
+
+
+def canonical_tag(tag: str) -> str:
+    """Key form of a hashtag, so that "#FR" and "#fr!" share a channel."""
+    return tag.casefold().rstrip(TRAILING_PUNCTUATION)
+
+
+def compress_raw(raw: dict) -> bytes:
+    return zlib.compress(json.dumps(raw, separators=(",", ":"), default=str).encode())
 
 
-@dataclass
 class Message:
-    id: Optional[str]
-    user_id: str
-    text: str
-    raw: dict
-    datetime: str = field(
-        init=False, default_factory=lambda: datetime.now(timezone.utc).isoformat()
-    )
+    __slots__ = ("id", "user_id", "text", "raw", "datetime")
+
+    def __init__(self, id: Optional[str], user_id: str, text: str, raw: dict):
+        self.id = id
+        self.user_id = user_id
+        self.text = text
+        self.raw = raw
+        self.datetime = datetime.now(timezone.utc).isoformat()
 
     @classmethod
     def generate_id(cls, app: str, app_id: Any):
         return f"{app} {app_id}"
 
+    def __repr__(self):
+        return f"<{type(self).__name__} id={self.id}>"
+
 
-@dataclass
 class SentMessage(Message):
-    reply_to: Optional[str] = None
-    pass
+    __slots__ = ("reply_to",)
 
+    def __init__(
+        self,
+        id: Optional[str],
+        user_id: str,
+        text: str,
+        raw: dict,
+        reply_to: Optional[str] = None,
+    ):
+        super().__init__(id, user_id, text, raw)
+        self.reply_to = reply_to
 
-@dataclass
-class IncomingMessage(Message):
-    tags: str = field(init=False)
-    seq: Optional[int] = field(init=False)
-    sender_display_name: str
-    reply_to: Optional[str] = None
 
-    def __post_init__(self):
+class IncomingMessage(Message):
+    __slots__ = ("tags", "seq", "shard", "sender_display_name", "reply_to")
+
+    def __init__(
+        self,
+        id: Optional[str],
+        user_id: str,
+        text: str,
+        raw: dict,
+        sender_display_name: Optional[str],
+        reply_to: Optional[str] = None,
+    ):
+        super().__init__(id, user_id, text, raw)
+        self.sender_display_name = sender_display_name
+        self.reply_to = reply_to
         self.tags = self.extract_and_sort_hashtags(default=["world"])
+        self.seq = None
+        self.shard = 0
+
+    def to_balloon_item(self) -> dict:
+        """Item of the balloons table, with only the fields read back.
+
+        The platform payload is stored according to BALLOON_RAW.
+        """
+        item = {
+            "id": self.id,
+            "user_id": self.user_id,
+            "text": self.text,
+            "sender_display_name": self.sender_display_name,
+            "tags": self.partition,
+            "seq": self.seq,
+            "datetime": self.datetime,
+        }
+        if BALLOON_RAW == "compressed":
+            item["raw_z"] = compress_raw(self.raw)
+        elif BALLOON_RAW == "full":
+            item["raw"] = self.raw
+        return item
+
+    @property
+    def partition(self) -> str:
+        """Key of the balloons partition and counter, see shards."""
+        return shards.partition(self.tags, self.shard)
+
+    def set_seq(self) -> Optional[dict]:
+        """Allocate the next seq of the tags, store the balloon and return the
+        previous one.
+
+        The balloon is stored as the last_balloon of the tags counter, and the
+        one it replaces is returned by the same update (None for the first
+        balloon, or if the previous one was written before last_balloon).
+        """
+        self.shard = shards.pick(self.tags)
 
-    def set_seq(self):
         try:
-            self.seq = balloons_seq_table.update_item(
-                Key={"tags": self.tags},
-                UpdateExpression="SET seq = if_not_exists (seq, :0) + :1, last_message_day = :last_message_day, last_message = :last_message",
+            previous = balloons_seq_table.update_item(
+                Key={"tags": self.partition},
+                UpdateExpression="SET seq = if_not_exists (seq, :0) + :1, last_message_day = :last_message_day, last_message = :last_message, last_balloon = :last_balloon",
                 ExpressionAttributeValues={
                     ":0": 0,
                     ":1": 1,
@@ -50,15 +120,54 @@ class IncomingMessage(Message):
                     .date()
                     .isoformat(),
                     ":last_message": self.datetime,
+                    ":last_balloon": {
+                        "id": self.id,
+                        "user_id": self.user_id,
+                        "text": self.text,
+                        "sender_display_name": self.sender_display_name,
+                        "tags": self.partition,
+                        "datetime": self.datetime,
+                    },
                 },
-                ReturnValues="UPDATED_NEW",
-            )["Attributes"]["seq"]
+                ReturnValues="ALL_OLD",
+            ).get("Attributes", {})
         except ClientError as e:
             raise e
 
+        self.seq = previous.get("seq", 0) + 1
+        if "shards" in previous:
+            shards.learn(self.tags, previous["shards"])
+
+        # written now, not with the other writes of the request: the next
+        # balloon of the tags pairs with this one as soon as the counter moved,
+        # and may set sent_message_id on it first, which an update keeps
+        item = self.to_balloon_item()
+        key = {"tags": item.pop("tags"), "seq": item.pop("seq")}
+        balloons_table.update_item(
+            Key=key,
+            UpdateExpression="SET " + ", ".join(f"#{name} = :{name}" for name in item),
+            ExpressionAttributeNames={f"#{name}": name for name in item},
+            ExpressionAttributeValues={
+                f":{name}": value for name, value in item.items()
+            },
+        )
+
+        if "last_balloon" not in previous:
+            return None
+
+        return {**previous["last_balloon"], "seq": previous["seq"]}
+
     def extract_and_sort_hashtags(self, default):
         tags = sorted(
-            set(part[1:] for part in self.text.split() if part.startswith("#"))
+            set(
+                tag
+                for tag in (
+                    canonical_tag(part[1:])
+                    for part in self.text.split()
+                    if part.startswith("#")
+                )
+                if tag
+            )
         )
 
         if len(tags) == 0:
@@ -67,11 +176,41 @@ class IncomingMessage(Message):
         return " ".join(tags)
 
 
-@dataclass
 class ButtonCallback(IncomingMessage):
-    original_message: Optional[IncomingMessage] = None
+    """A button press.
+
+    The message holding the button is kept raw, and only parsed with
+    `original_parser` on first access to `original_message`.
+    """
+
+    __slots__ = ("_original_raw", "_original_parser", "_original_message")
+
+    def __init__(
+        self,
+        id: Optional[str],
+        user_id: str,
+        text: str,
+        raw: dict,
+        sender_display_name: Optional[str],
+        reply_to: Optional[str] = None,
+        original_raw: Optional[dict] = None,
+        original_parser: Optional[Callable[[dict], IncomingMessage]] = None,
+    ):
+        super().__init__(id, user_id, text, raw, sender_display_name, reply_to)
+        self._original_raw = original_raw
+        self._original_parser = original_parser
+        self._original_message = _UNPARSED
+
+    @property
+    def original_message(self) -> Optional[IncomingMessage]:
+        if self._original_message is _UNPARSED:
+            self._original_message = (
+                None
+                if self._original_raw is None
+                else self._original_parser(self._original_raw)
+            )
+        return self._original_message
 
 
-@dataclass
 class Command(IncomingMessage):
-    pass
+    __slots__ = ()
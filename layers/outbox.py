@@ -0,0 +1,72 @@
+from concurrent.futures import Future
+from typing import Optional
+
+import layers.messages
+from layers.senders import senders, webhook_response
+
+
+class Outbox:
+    """Outbound messages of a request, delivered once it has been handled.
+
+    Messages keep their order within a chat. Each platform sends its messages
+    together (see BaseSender.send_messages), and `enqueue` returns a future of
+    the message id, resolved by `flush`.
+    """
+
+    def __init__(self):
+        self._outgoing = []
+
+    def enqueue(
+        self,
+        message: layers.messages.SentMessage,
+        markdown: bool = False,
+        buttons: Optional[list] = None,
+        need_id: bool = False,
+    ) -> Future:
+        future = Future()
+        self._outgoing.append((message, markdown, buttons, need_id, future))
+        return future
+
+    def flush(self, webhook_reply: bool = False) -> Optional[str]:
+        """Send all messages, return the webhook response body if any.
+
+        With `webhook_reply`, the last message goes in the webhook response if
+        its platform supports it and its id is not needed.
+        """
+        outgoing, self._outgoing = self._outgoing, []
+        response = None
+
+        if webhook_reply and outgoing and not outgoing[-1][3]:
+            message, markdown, buttons, need_id, future = outgoing[-1]
+            try:
+                response = webhook_response(message, markdown, buttons)
+            except NotImplementedError:
+                pass
+            else:
+                outgoing.pop()
+                future.set_result(None)
+
+        platforms = {}
+        for item in outgoing:
+            platforms.setdefault(item[0].user_id.split(" ")[0], []).append(item)
+
+        errors = []
+        for platform, items in platforms.items():
+            results = senders[platform]().send_messages(
+                [
+                    (message, markdown, buttons)
+                    for message, markdown, buttons, *_ in items
+                ]
+            )
+            for (message, *_, future), result in zip(items, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                    errors.append(result)
+                else:
+                    message.id, message.raw = result
+                    future.set_result(message.id)
+
+        if errors:
+            raise errors[0]
+
+        return response
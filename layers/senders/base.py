@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 
 import layers.messages
 
@@ -11,3 +11,24 @@ class BaseSender:
         buttons: Optional[list] = None,
     ) -> (str, dict):
         raise NotImplementedError
+
+    def send_messages(self, outgoing: List[tuple]) -> list:
+        """Send several (message, markdown, buttons), in order.
+
+        Returns, for each message, its (id, raw) or the exception raised.
+        """
+        results = []
+        for message, markdown, buttons in outgoing:
+            try:
+                results.append(self.send_message(message, markdown, buttons))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def webhook_response(
+        self,
+        message: layers.messages.SentMessage,
+        markdown: bool = False,
+        buttons: Optional[list] = None,
+    ) -> str:
+        raise NotImplementedError
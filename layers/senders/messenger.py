@@ -1,11 +1,12 @@
+import json
 import logging
-from typing import Optional
-
-import requests
+from typing import List, Optional
 
 import layers.messages
+import layers.sessions
 import models
 from requests import HTTPError
+from urllib.parse import urlencode
 from layers.senders.base import BaseSender
 from settings import FB_PAGE_TOKEN
 
@@ -13,12 +14,12 @@ logger = logging.getLogger(__name__)
 
 
 class MessengerSender(BaseSender):
-    def send_message(
+    def build_request(
         self,
         message: layers.messages.SentMessage,
         markdown: bool = False,
         buttons: Optional[list] = None,
-    ):
+    ) -> dict:
         recipient = str(message.user_id).replace(models.APP_MESSENGER + " ", "")
         reply_to_message_id = (
             message.reply_to.split(" ")[1]
@@ -46,14 +47,22 @@ class MessengerSender(BaseSender):
         else:
             message_json = {"text": message.text}
 
-        post_data = {
+        return {
             "recipient": {"id": recipient},
             "message": message_json,
         }
 
+    def send_message(
+        self,
+        message: layers.messages.SentMessage,
+        markdown: bool = False,
+        buttons: Optional[list] = None,
+    ):
+        post_data = self.build_request(message, markdown, buttons)
+
         res = None
         try:
-            res = requests.post(
+            res = layers.sessions.get(models.APP_MESSENGER).post(
                 "https://graph.facebook.com/v2.6/me/messages",
                 params={"access_token": FB_PAGE_TOKEN},
                 json=post_data,
@@ -70,3 +79,58 @@ class MessengerSender(BaseSender):
             ),
             post_data,
         )
+
+    def send_messages(self, outgoing: List[tuple]) -> list:
+        # one Graph API batch request, each message depending on the previous
+        # one to the same recipient so that they keep their order
+        if len(outgoing) == 1:
+            return super().send_messages(outgoing)
+
+        batch = []
+        post_data = []
+        last = {}
+        for i, (message, markdown, buttons) in enumerate(outgoing):
+            data = self.build_request(message, markdown, buttons)
+            post_data.append(data)
+            request = {
+                "method": "POST",
+                "relative_url": "v2.6/me/messages",
+                "name": f"message{i}",
+                "omit_response_on_success": False,
+                "body": urlencode(
+                    {key: json.dumps(value) for key, value in data.items()}
+                ),
+            }
+            if message.user_id in last:
+                request["depends_on"] = last[message.user_id]
+            last[message.user_id] = request["name"]
+            batch.append(request)
+
+        res = None
+        try:
+            res = layers.sessions.get(models.APP_MESSENGER).post(
+                "https://graph.facebook.com/",
+                data={"access_token": FB_PAGE_TOKEN, "batch": json.dumps(batch)},
+            )
+            res.raise_for_status()
+        except HTTPError as e:
+            if res is not None:
+                logger.error(res.text)
+            return [e] * len(outgoing)
+
+        results = []
+        for data, response in zip(post_data, res.json()):
+            if response is None or response["code"] != 200:
+                logger.error(response)
+                results.append(HTTPError(f"Graph API batch request failed: {response}"))
+                continue
+            results.append(
+                (
+                    layers.messages.SentMessage.generate_id(
+                        app=models.APP_MESSENGER,
+                        app_id=json.loads(response["body"])["message_id"],
+                    ),
+                    data,
+                )
+            )
+        return results
@@ -1,25 +1,31 @@
 import json
 import logging
-from typing import Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
-import requests
 from requests import HTTPError
 
 import layers.messages
+import layers.sessions
 import models
 from callbacks.command import dynamic
-from settings import TELEGRAM_API
+from layers import tracing
+from layers.senders.base import BaseSender
+from settings import OUTBOX_WORKERS, TELEGRAM_API
 
 logger = logging.getLogger(__name__)
 
+_executor = ThreadPoolExecutor(max_workers=OUTBOX_WORKERS)
 
-class TelegramSender:
-    def send_message(
+
+class TelegramSender(BaseSender):
+    def build_request(
         self,
         message: layers.messages.SentMessage,
         markdown: bool = False,
         buttons: Optional[list] = None,
-    ):
+    ) -> (str, dict):
         chat_id = str(message.user_id).replace(models.APP_TELEGRAM + " ", "")
         reply_to_message_id = (
             message.reply_to.split(" ")[2]
@@ -56,9 +62,21 @@ class TelegramSender:
             **kwargs,
         }
 
+        return "sendMessage", data
+
+    def send_message(
+        self,
+        message: layers.messages.SentMessage,
+        markdown: bool = False,
+        buttons: Optional[list] = None,
+    ):
+        method, data = self.build_request(message, markdown, buttons)
+
         res = None
         try:
-            res = requests.post(TELEGRAM_API + "sendMessage", data=data)
+            res = layers.sessions.get(models.APP_TELEGRAM).post(
+                TELEGRAM_API + method, data=data
+            )
             res.raise_for_status()
         except HTTPError as e:
             if res is not None:
@@ -74,3 +92,48 @@ class TelegramSender:
             ),
             data,
         )
+
+    def send_messages(self, outgoing: List[tuple]) -> list:
+        # chats are sent to concurrently, each chat in order
+        chats = OrderedDict()
+        for i, item in enumerate(outgoing):
+            chats.setdefault(item[0].user_id, []).append(i)
+
+        if len(chats) == 1:
+            return super().send_messages(outgoing)
+
+        results = [None] * len(outgoing)
+
+        def send_chat(indexes):
+            for i, result in zip(
+                indexes,
+                super(TelegramSender, self).send_messages(
+                    [outgoing[i] for i in indexes]
+                ),
+            ):
+                results[i] = result
+
+        for future in [
+            _executor.submit(tracing.run_in_context(send_chat), indexes)
+            for indexes in chats.values()
+        ]:
+            future.result()
+
+        return results
+
+    def webhook_response(
+        self,
+        message: layers.messages.SentMessage,
+        markdown: bool = False,
+        buttons: Optional[list] = None,
+    ) -> str:
+        # Telegram runs one method call given as the webhook response body
+        method, data = self.build_request(message, markdown, buttons)
+        body = {
+            "method": method,
+            **{key: value for key, value in data.items() if value is not None},
+        }
+        if "reply_markup" in body:
+            body["reply_markup"] = json.loads(body["reply_markup"])
+
+        return json.dumps(body)
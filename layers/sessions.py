@@ -0,0 +1,54 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+
+from layers import tracing
+from settings import HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        tracing.count("http_connections")
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        tracing.count("http_connections")
+        return super()._new_conn()
+
+
+class CountingAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get(platform) -> requests.Session:
+    """Return the pooled keep-alive session of a platform.
+
+    Sessions live at module level, so they survive warm Lambda invocations.
+    """
+    if platform not in _sessions:
+        with _sessions_lock:
+            if platform not in _sessions:
+                session = requests.Session()
+                adapter = CountingAdapter(
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.hooks["response"].append(tracing.record_response)
+                _sessions[platform] = session
+
+    return _sessions[platform]
@@ -0,0 +1,131 @@
+"""Per-request tracing of DynamoDB calls, HTTP calls and retry sleeps.
+
+A trace is opened for each message handled, spans are appended to it from any
+thread running in its context, and it is emitted as a single JSON log line
+when the message is done. Recording a span is a tuple append, cheap enough
+to stay on in production. Counters, such as the HTTP connections opened,
+are added up with the spans.
+"""
+import contextvars
+import json
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter
+from urllib.parse import urlparse
+
+from settings import TRACING
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    def __init__(self, name):
+        self.name = name
+        self.start = perf_counter()
+        self.spans = []
+        self.counters = Counter()
+
+    def as_dict(self):
+        return {
+            "trace": self.name,
+            "duration": round(perf_counter() - self.start, 6),
+            "counters": dict(self.counters),
+            "spans": [
+                {
+                    "kind": kind,
+                    "operation": operation,
+                    "target": target,
+                    "duration": round(duration, 6),
+                    **extra,
+                }
+                for kind, operation, target, duration, extra in self.spans
+            ],
+        }
+
+
+@contextmanager
+def trace(name):
+    if not TRACING:
+        yield None
+        return
+
+    current = Trace(name)
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+        logger.info(json.dumps(current.as_dict()))
+
+
+def record(kind, operation, target, duration, **extra):
+    current = _current.get()
+    if current is not None:
+        current.spans.append((kind, operation, target, duration, extra))
+
+
+_counters_lock = threading.Lock()
+
+
+def count(name, value=1):
+    current = _current.get()
+    if current is not None:
+        with _counters_lock:
+            current.counters[name] += value
+
+
+def record_backoff(details):
+    """on_backoff handler of the backoff decorators."""
+    record(
+        "sleep",
+        details["target"].__name__,
+        None,
+        details["wait"],
+        tries=details["tries"],
+    )
+
+
+def before_dynamodb_call(params, context, **kwargs):
+    context["trace_target"] = params.get("TableName") or ",".join(
+        params.get("RequestItems", ())
+    )
+    context["trace_start"] = perf_counter()
+
+
+def after_dynamodb_call(parsed, model, context, **kwargs):
+    if "trace_start" in context:
+        record(
+            "dynamodb",
+            model.name,
+            context["trace_target"],
+            perf_counter() - context["trace_start"],
+            retries=parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0),
+        )
+
+
+def instrument_dynamodb(client):
+    client.meta.events.register("before-parameter-build.dynamodb", before_dynamodb_call)
+    client.meta.events.register("after-call.dynamodb", after_dynamodb_call)
+
+
+def record_response(response, **kwargs):
+    url = urlparse(response.request.url)
+    operation = url.path.rsplit("/", 1)[-1]
+    record(
+        "http",
+        f"{response.request.method} {':id' if operation.isdigit() else operation}",
+        url.netloc,
+        response.elapsed.total_seconds(),
+        status=response.status_code,
+    )
+
+
+def run_in_context(fn):
+    """Wrap `fn` to run in the current context, for use in another thread."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
@@ -0,0 +1,33 @@
+"""Balloon bucket of a user.
+
+A user spends one balloon per message. Once they are out of balloons, they
+earn them back with time : after `t` since their last balloon, they get the
+number of times `t` can be halved before falling under REFILL_PERIOD.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+REFILL_PERIOD = timedelta(hours=1)
+
+
+def refill(updated: datetime, now: datetime) -> int:
+    """Balloons earned by an empty bucket between `updated` and `now`."""
+    elapsed = now - updated
+    if elapsed <= REFILL_PERIOD:
+        return 0
+
+    # smallest n such that elapsed / 2 ** n <= REFILL_PERIOD
+    periods = -(-elapsed // REFILL_PERIOD)
+    return (periods - 1).bit_length()
+
+
+def take(balloons: int, updated: datetime, now: datetime) -> Optional[int]:
+    """Balloons left after taking one at `now`, None if there is none to take."""
+    if balloons > 0:
+        return balloons - 1
+
+    earned = refill(updated, now)
+    if earned == 0:
+        return None
+
+    return earned - 1
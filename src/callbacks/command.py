@@ -1,32 +1,71 @@
-from datetime import timezone, datetime, timedelta
+from base64 import urlsafe_b64encode
+from hashlib import sha256
+from time import time
 from urllib.parse import unquote_plus
-from uuid import uuid4
 
-import backoff
-from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.conditions import Attr
 from botocore.exceptions import ClientError
 
 import models
 import strings
+import trending
 from callbacks import buttons
+from layers.cache import TTLCache
 from layers.interface import PostbackButton
+from settings import (
+    TRENDING_TOP_K,
+    CALLBACK_TTL,
+    CALLBACK_CACHE_SIZE,
+    CALLBACK_CACHE_TTL,
+    CALLBACK_MISSING_TTL,
+)
+
+
+# callback ids are derived from the command, so rendering the same button twice
+# writes one row, and a process only writes a given row once per cache period
+callback_paths = TTLCache(maxsize=CALLBACK_CACHE_SIZE, ttl=CALLBACK_CACHE_TTL)
+missing_callbacks = TTLCache(maxsize=CALLBACK_CACHE_SIZE, ttl=CALLBACK_MISSING_TTL)
 
 
 def dynamic(command):
-    id = uuid4().hex
-    models.callbacks_table.put_item(Item={"id": id, "path": command})
+    id = urlsafe_b64encode(sha256(command.encode()).digest()[:18]).decode()
+
+    if callback_paths.get(id) != command:
+        models.callbacks_table.put_item(
+            Item={"id": id, "path": command, "expires": int(time()) + CALLBACK_TTL}
+        )
+        callback_paths.set(id, command)
+        missing_callbacks.delete(id)
+
     return f":{id}"
 
 
-@backoff.on_predicate(backoff.expo, base=2, factor=0.125, max_value=1, max_time=5)
 def reverse(id):
-    return models.callbacks_table.get_item(Key={"id": id}).get("Item", {}).get("path")
+    path = callback_paths.get(id)
+    if path is not None or id in missing_callbacks:
+        return path
+
+    path = (
+        models.callbacks_table.get_item(Key={"id": id}, ConsistentRead=True)
+        .get("Item", {})
+        .get("path")
+    )
+
+    if path is None:
+        missing_callbacks.set(id, True)
+    else:
+        callback_paths.set(id, path)
+
+    return path
 
 
 def command(handler):
     if handler.message.text.startswith(":"):
         handler.message.text = reverse(handler.message.text[1:])
 
+        if handler.message.text is None:
+            return handler.reply_message("Sorry! This button has expired.")
+
     if handler.message.text == "help":
         return handler.reply_message(strings.BALLOONS_HELP)
 
@@ -64,11 +103,20 @@ def command(handler):
                 Key={"tags": tags, "seq": seq},
                 UpdateExpression="SET balloon_back = :1",
                 ExpressionAttributeValues={":1": True},
-                ConditionExpression=Attr("balloon_back").not_exists(),
+                # the balloon may not be written yet, see IncomingMessage.set_seq
+                ConditionExpression=Attr("balloon_back").not_exists()
+                & Attr("user_id").exists(),
                 ReturnValues="ALL_NEW",
             )["Attributes"]["user_id"]
         except ClientError as e:
             if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                item = models.balloons_table.get_item(
+                    Key={"tags": tags, "seq": seq}
+                ).get("Item", {})
+                if "balloon_back" not in item:
+                    return handler.reply_message(
+                        "Sorry! This balloon can not be sent back yet, try again in a moment."
+                    )
                 return handler.reply_message("You have already gave a free balloon.")
             raise e
         else:
@@ -87,35 +135,31 @@ def command(handler):
             (base, tags, seq) = handler.message.text.split("/")
             tags = unquote_plus(tags)
             seq = int(seq)
-            sent_message_id = models.balloons_table.get_item(
-                Key={"tags": tags, "seq": seq}
-            )["Item"]["sent_message_id"]
+            sent_message_id = (
+                models.balloons_table.get_item(Key={"tags": tags, "seq": seq})
+                .get("Item", {})
+                .get("sent_message_id")
+            )
         else:
             (base, reply_id) = handler.message.text.split("/")
-            sent_message_id = models.conversations_table.get_item(Key={"id": reply_id})[
-                "Item"
-            ]["replied_back"]
+            sent_message_id = (
+                models.conversations_table.get_item(Key={"id": reply_id})
+                .get("Item", {})
+                .get("replied_back")
+            )
+
+        if sent_message_id is None:
+            return handler.reply_message(
+                "Sorry! This message can not be answered yet, try again in a moment."
+            )
 
         handler.set_question(models.Question("reply", {"reply_to": sent_message_id}))
         return handler.reply_message("Type your reply :")
 
     if handler.message.text.startswith("trending"):
-        items = list(
-            item
-            for i in range(7)
-            for item in models.balloons_seq_table.query(
-                IndexName="last_message",
-                KeyConditionExpression=Key("last_message_day").eq(
-                    (datetime.now(timezone.utc) - timedelta(days=i)).date().isoformat()
-                ),
-            )["Items"]
-            if item["tags"] != "world"
-        )
-        items.sort(key=lambda item: item["seq"], reverse=True)
-
         trendings = "\n".join(
-            f"{c + 1} - #{item['tags'].replace(' ', ' #')}"
-            for c, item in enumerate(items)
+            f"{c + 1} - {tags}"
+            for c, (tags, score) in enumerate(trending.top(TRENDING_TOP_K))
         )
         return handler.reply_message(
             f"Here are the trending hashtags:\n{trendings}",
@@ -6,60 +6,59 @@ import backoff as backoff
 from boto3.dynamodb.conditions import Attr
 from botocore.exceptions import ClientError
 
+import balloons
 import layers
 import strings
 import models
+import tag_index
+import trending
 from callbacks import buttons
 from callbacks.utils import generate_status
+from layers import tracing
 from layers.interface import PostbackButton
-from layers.senders import send_message
+
+BALLOON_ATTEMPTS = 3
 
 if TYPE_CHECKING:
     from layers.handlers import BaseMessageHandler
 
 
 def remove_balloon(handler: "BaseMessageHandler"):
-    # take a balloon from the user
-    # we first try to remove a balloon from the user by checking thay have more than 1
-    # of not, we check if last time a balloon was removed was more than 12 hours ago
-    # else, no more balloon
-
-    now = datetime.now(timezone.utc)
+    # take a balloon from the user with a single write, guarded on the balloons
+    # we computed from, and start again from fresh values on a conflict
+    user = handler.user
 
-    try:
-        models.users_table.update_item(
-            Key={"id": handler.message.user_id},
-            UpdateExpression="SET balloons = balloons - :1, balloons_updated = :now",
-            ExpressionAttributeValues={":1": 1, ":now": now.isoformat()},
-            ConditionExpression=Attr("balloons").gt(0),
-        )
-        handler.user.balloons = handler.user.balloons - 1
-        handler.user.balloons_updated = now
-    except ClientError as e:
-        if not e.response["Error"]["Code"] == "ConditionalCheckFailedException":
-            raise e
+    for attempt in range(BALLOON_ATTEMPTS):
+        now = datetime.now(timezone.utc)
+        left = balloons.take(user.balloons, user.balloons_updated, now)
 
-        accumulation_duration = now - handler.user.balloons_updated
-        new_balloons = 0
-        while accumulation_duration > timedelta(hours=1):
-            accumulation_duration = accumulation_duration / 2
-            new_balloons = new_balloons + 1
-
-        if new_balloons == 0:
+        if left is None:
             return False
 
-        models.users_table.update_item(
-            Key={"id": handler.message.user_id},
-            UpdateExpression="SET balloons = :balloons, balloons_updated = :now",
-            ExpressionAttributeValues={
-                ":balloons": new_balloons - 1,
-                ":now": now.isoformat(),
-            },
-        )
-        handler.user.balloons = new_balloons - 1
-        handler.user.balloons_updated = now
-
-    return True
+        try:
+            models.users_table.update_item(
+                Key={"id": user.id},
+                UpdateExpression="SET balloons = :balloons, balloons_updated = :now",
+                ExpressionAttributeValues={":balloons": left, ":now": now.isoformat()},
+                ConditionExpression=Attr("balloons_updated").eq(
+                    user.balloons_updated.isoformat()
+                )
+                & Attr("balloons").eq(user.balloons),
+            )
+        except ClientError as e:
+            if not e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                raise e
+            if attempt == BALLOON_ATTEMPTS - 1:
+                raise e
+
+            item = models.users_table.get_item(Key={"id": user.id}, ConsistentRead=True)
+            fresh = models.User.from_item(item["Item"])
+            user.balloons = fresh.balloons
+            user.balloons_updated = fresh.balloons_updated
+        else:
+            user.balloons = left
+            user.balloons_updated = now
+            return True
 
 
 @backoff.on_predicate(
@@ -69,6 +68,7 @@ def remove_balloon(handler: "BaseMessageHandler"):
     factor=0.125,
     max_value=1,
     max_time=5,
+    on_backoff=tracing.record_backoff,
 )
 def poll_message(tags, seq):
     return models.balloons_table.get_item(
@@ -97,7 +97,7 @@ def reply_handler(handler: "BaseMessageHandler", reply_to):
 
         sent_for = item["sent_for"]
 
-        reply = send_message(
+        reply = handler.outbox.enqueue(
             layers.messages.SentMessage(
                 id=None,
                 user_id=sent_for,
@@ -110,21 +110,24 @@ def reply_handler(handler: "BaseMessageHandler", reply_to):
                 PostbackButton(text=f"↩️ Reply", command=f"reply/{item['id']}",),
                 buttons.new_balloon,
             ],
+            need_id=True,
         )
 
-        models.conversations_table.update_item(
+        handler.writes.update(
+            models.conversations_table,
             Key={"id": reply_to},
             UpdateExpression="SET replied_back = :1",
-            ExpressionAttributeValues={":1": reply.id},
+            ExpressionAttributeValues={":1": reply},
         )
 
-        return models.conversations_table.put_item(
-            Item={
-                "id": reply.id,
+        handler.writes.put(
+            models.conversations_table,
+            {
+                "id": reply,
                 "datetime": handler.message.datetime,
                 "sent_for": handler.message.user_id,
                 "original_message_id": handler.message.id,
-            }
+            },
         )
 
 
@@ -136,27 +139,37 @@ def new_balloon_handler(handler: "BaseMessageHandler"):
     if not remove_balloon(handler):
         return handler.reply_message(strings.NO_MORE_balloon)
 
-    # update counter and store message
-    handler.message.set_seq()
-    models.balloons_table.put_item(Item=models.asddbdict(handler.message))
+    # update counter, store this message and get the previous one
+    item = handler.message.set_seq()
+    # trending is best effort, counted off the path of the reply
+    handler.deferred.defer(
+        trending.record,
+        handler.message.tags,
+        datetime.fromisoformat(handler.message.datetime),
+    )
+    tag_index.record(handler.writes, handler.message.tags, handler.message.datetime)
 
-    # if first message in channel, stop
+    # if first message in channel, pair with the closest channel, or stop
     if handler.message.seq == 1:
-        handler.reply_message(
-            strings.NO_MESSAGE_EVER + generate_status(handler),
-            buttons=[buttons.new_balloon, buttons.trending],
+        item = tag_index.find_balloon(handler.message.tags, handler.message.user_id)
+
+        if item is None:
+            handler.reply_message(
+                strings.NO_MESSAGE_EVER + generate_status(handler),
+                buttons=[buttons.new_balloon, buttons.trending],
+            )
+            return
+
+    # previous message stored before counters kept it
+    if item is None:
+        response = models.balloons_table.get_item(
+            Key={"tags": handler.message.partition, "seq": handler.message.seq - 1}
         )
-        return
-
-    # get the previous one
-    response = models.balloons_table.get_item(
-        Key={"tags": handler.message.tags, "seq": handler.message.seq - 1}
-    )
 
-    if "Item" not in response:
-        response = poll_message(handler.message.tags, handler.message.seq)
+        if "Item" not in response:
+            response = poll_message(handler.message.partition, handler.message.seq)
 
-    item = response["Item"]
+        item = response["Item"]
 
     # if the previous one is from the same person, tell them
     if handler.message.user_id == item["user_id"]:
@@ -169,6 +182,7 @@ def new_balloon_handler(handler: "BaseMessageHandler"):
     text = strings.MESSAGE_INTRO.format(item["sender_display_name"]) + item["text"]
     reply = handler.reply_message(
         text + generate_status(handler),
+        need_id=True,
         buttons=[
             PostbackButton(
                 text="💙 Give a free balloon",
@@ -183,28 +197,26 @@ def new_balloon_handler(handler: "BaseMessageHandler"):
     )
 
     # update sent_to on previous item
-    models.balloons_table.update_item(
+    handler.writes.update(
+        models.balloons_table,
         Key={"tags": item["tags"], "seq": item["seq"]},
         UpdateExpression="SET sent_message_id = :sent_message_id",
-        ExpressionAttributeValues={":sent_message_id": reply.id},
+        ExpressionAttributeValues={":sent_message_id": reply},
     )
 
-    models.conversations_table.put_item(
-        Item={
-            "id": reply.id,
-            "datetime": reply.datetime,
+    handler.writes.put(
+        models.conversations_table,
+        {
+            "id": reply,
+            "datetime": handler.message.datetime,
             "sent_for": item["user_id"],
             "original_message_id": item["id"],
-        }
+        },
     )
 
     if not handler.user.first_balloon:
         handler.reply_message(strings.BALLOONS_HELP)
-        models.users_table.update_item(
-            Key={"id": handler.user.id},
-            UpdateExpression="SET first_balloon = :True",
-            ExpressionAttributeValues={":True": True},
-        )
+        handler.session.set("first_balloon", True)
 
 
 def default_handler(handler):
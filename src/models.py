@@ -1,99 +1,247 @@
-from dataclasses import dataclass, asdict as _base_asdict, field
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Any, Optional
+from typing import Any, Iterable, Iterator, Optional
 
 import boto3
+from boto3.dynamodb.conditions import Attr
 
 import settings
+from layers import tracing
 
 prefix = settings.TABLE_PREFIX
+REGION = "eu-west-3"
 
-dynamodb = boto3.resource("dynamodb", region_name="eu-west-3")
-existing_tables = boto3.client("dynamodb").list_tables()["TableNames"]
+# Table schemas, as passed to create_table. Tables are created and migrated by
+# the schema command (src/schema.py), never from the request path.
+TABLES = {
+    "balloons": dict(primary_key=("tags", "S"), sort_key=("seq", "N")),
+    "balloons_seq": dict(
+        primary_key=("tags", "S"),
+        extra_attr_def=[
+            {"AttributeName": "last_message", "AttributeType": "S"},
+            {"AttributeName": "last_message_day", "AttributeType": "S"},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "last_message",
+                "KeySchema": [
+                    {"AttributeName": "last_message_day", "KeyType": "HASH"},
+                    {"AttributeName": "last_message", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }
+        ],
+    ),
+    "callbacks": dict(ttl_attribute="expires"),
+    "users": dict(),
+    "conversations": dict(),
+    "trending_counts": dict(ttl_attribute="expires"),
+    "updates": dict(ttl_attribute="expires"),
+    "tag_index": dict(
+        primary_key=("tag", "S"),
+        sort_key=("tags", "S"),
+        extra_attr_def=[{"AttributeName": "last_message", "AttributeType": "S"}],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "last_message",
+                "KeySchema": [
+                    {"AttributeName": "tag", "KeyType": "HASH"},
+                    {"AttributeName": "last_message", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }
+        ],
+        ttl_attribute="expires",
+    ),
+}
 
+# boto3 resources are not thread safe, so each thread gets its own.
+_local = threading.local()
 
-def get_or_create_table(
-    table_name, primary_key=("id", "S"), sort_key=None, extra_attr_def=None, **kwargs
-):
-    if table_name in existing_tables:
-        return dynamodb.Table(table_name)
 
-    attr_def = [{"AttributeName": primary_key[0], "AttributeType": primary_key[1]}]
-    key_def = [{"AttributeName": primary_key[0], "KeyType": "HASH"}]
+def get_dynamodb():
+    if not hasattr(_local, "dynamodb"):
+        _local.dynamodb = boto3.resource("dynamodb", region_name=REGION)
+        tracing.instrument_dynamodb(_local.dynamodb.meta.client)
+        _local.tables = {}
+    return _local.dynamodb
 
-    if sort_key is not None:
-        attr_def.append({"AttributeName": sort_key[0], "AttributeType": sort_key[1]})
-        key_def.append({"AttributeName": sort_key[0], "KeyType": "RANGE"})
 
-    if extra_attr_def is not None:
-        attr_def.extend(extra_attr_def)
+class LazyTable:
+    """Table handle resolved on first use, without any control-plane call."""
 
-    dynamodb.create_table(
-        TableName=table_name,
-        BillingMode="PAY_PER_REQUEST",
-        AttributeDefinitions=attr_def,
-        KeySchema=key_def,
-        **kwargs,
-    )
+    def __init__(self, name):
+        self.name = name
 
-    return dynamodb.Table(table_name)
-
-
-balloons_table = get_or_create_table(f"{prefix}balloons", ("tags", "S"), ("seq", "N"))
-balloons_seq_table = get_or_create_table(
-    f"{prefix}balloons_seq",
-    ("tags", "S"),
-    extra_attr_def=[
-        {"AttributeName": "last_message", "AttributeType": "S"},
-        {"AttributeName": "last_message_day", "AttributeType": "S"},
-    ],
-    GlobalSecondaryIndexes=[
-        {
-            "IndexName": "last_message",
-            "KeySchema": [
-                {"AttributeName": "last_message_day", "KeyType": "HASH"},
-                {"AttributeName": "last_message", "KeyType": "RANGE"},
-            ],
-            "Projection": {"ProjectionType": "ALL"},
-        }
-    ],
-)
-callbacks_table = get_or_create_table(f"{prefix}callbacks")
-users_table = get_or_create_table(f"{prefix}users")
-conversations_table = get_or_create_table(f"{prefix}conversations")
+    def __getattr__(self, attr):
+        dynamodb = get_dynamodb()
+        if self.name not in _local.tables:
+            _local.tables[self.name] = dynamodb.Table(self.name)
+        return getattr(_local.tables[self.name], attr)
+
+    def __repr__(self):
+        return f"<LazyTable name={self.name}>"
+
+
+_query_executor = ThreadPoolExecutor(max_workers=settings.QUERY_WORKERS)
+_DONE = object()
+
+
+def query_many(
+    table: LazyTable,
+    queries: Iterable[dict],
+    limit: Optional[int] = None,
+    max_pages: Optional[int] = None,
+) -> Iterator[dict]:
+    """Run several queries on a table concurrently and stream their items.
+
+    Each query is a dict of `Table.query` arguments. Every query follows its
+    LastEvaluatedKey until it is exhausted or has read `max_pages` pages, or
+    until `limit` items have been yielded overall. Items come in the order
+    pages arrive, not query order.
+    """
+    results = queue.Queue()
+    stop = threading.Event()
+
+    def run(kwargs):
+        kwargs = dict(kwargs)
+        pages = 0
+        try:
+            while not stop.is_set():
+                page = table.query(**kwargs)
+                pages = pages + 1
+                for item in page["Items"]:
+                    results.put((item, None))
+                if "LastEvaluatedKey" not in page or pages == max_pages:
+                    break
+                kwargs["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+        except Exception as e:
+            results.put((None, e))
+        finally:
+            results.put((_DONE, None))
+
+    running = 0
+    for kwargs in queries:
+        _query_executor.submit(tracing.run_in_context(run), kwargs)
+        running = running + 1
+
+    count = 0
+    try:
+        while running > 0 and (limit is None or count < limit):
+            item, error = results.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                running = running - 1
+                continue
+            count = count + 1
+            yield item
+    finally:
+        stop.set()
+
+
+balloons_table = LazyTable(f"{prefix}balloons")
+balloons_seq_table = LazyTable(f"{prefix}balloons_seq")
+callbacks_table = LazyTable(f"{prefix}callbacks")
+users_table = LazyTable(f"{prefix}users")
+conversations_table = LazyTable(f"{prefix}conversations")
+trending_table = LazyTable(f"{prefix}trending_counts")
+tag_index_table = LazyTable(f"{prefix}tag_index")
+updates_table = LazyTable(f"{prefix}updates")
 
 APP_TELEGRAM = "telegram"
 APP_MESSENGER = "messenger"
 
 
-@dataclass
 class Question:
-    name: str
-    params: Optional[dict] = None
+    __slots__ = ("name", "params")
+
+    def __init__(self, name: str, params: Optional[dict] = None):
+        self.name = name
+        self.params = params
+
+    def to_item(self) -> dict:
+        return {"name": self.name, "params": self.params}
+
+    @classmethod
+    def from_item(cls, item: dict) -> "Question":
+        return cls(item["name"], item.get("params"))
+
+    def __repr__(self):
+        return f"<Question name={self.name}>"
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    return None if value is None else datetime.fromisoformat(value)
 
 
-@dataclass
 class User:
+    __slots__ = (
+        "id",
+        "created",
+        "balloons_updated",
+        "balloons",
+        "question",
+        "first_balloon",
+        "display_name",
+        "display_name_updated",
+    )
+
     @classmethod
     def generate_id(cls, app: str, app_id: Any):
         return f"{app} {app_id}"
 
-    id: str
-    created: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
-    balloons_updated: datetime = field(
-        default_factory=lambda: datetime.now(timezone.utc)
-    )
-    balloons: int = 5
-    question: Optional[Question] = None
-    first_balloon: bool = False
-
-    def __post_init__(self):
-        if isinstance(self.question, dict):
-            self.question = Question(**self.question)
-        if isinstance(self.created, str):
-            self.created = datetime.fromisoformat(self.created)
-        if isinstance(self.balloons_updated, str):
-            self.balloons_updated = datetime.fromisoformat(self.balloons_updated)
+    def __init__(
+        self,
+        id: str,
+        created: Optional[datetime] = None,
+        balloons_updated: Optional[datetime] = None,
+        balloons: int = 5,
+        question: Optional[Question] = None,
+        first_balloon: bool = False,
+        display_name: Optional[str] = None,
+        display_name_updated: Optional[datetime] = None,
+    ):
+        now = datetime.now(timezone.utc)
+        self.id = id
+        self.created = created or now
+        self.balloons_updated = balloons_updated or now
+        self.balloons = balloons
+        self.question = question
+        self.first_balloon = first_balloon
+        self.display_name = display_name
+        self.display_name_updated = display_name_updated
+
+    def to_item(self) -> dict:
+        return {
+            "id": self.id,
+            "created": self.created.isoformat(),
+            "balloons_updated": self.balloons_updated.isoformat(),
+            "balloons": self.balloons,
+            "question": None if self.question is None else self.question.to_item(),
+            "first_balloon": self.first_balloon,
+            "display_name": self.display_name,
+            "display_name_updated": None
+            if self.display_name_updated is None
+            else self.display_name_updated.isoformat(),
+        }
+
+    @classmethod
+    def from_item(cls, item: dict) -> "User":
+        question = item.get("question")
+        return cls(
+            id=item["id"],
+            created=_parse_datetime(item.get("created")),
+            balloons_updated=_parse_datetime(item.get("balloons_updated")),
+            balloons=item.get("balloons", 5),
+            question=None if question is None else Question.from_item(question),
+            first_balloon=item.get("first_balloon", False),
+            display_name=item.get("display_name"),
+            display_name_updated=_parse_datetime(item.get("display_name_updated")),
+        )
 
     def __repr__(self):
         return f"<User id={self.id}>"
@@ -102,11 +250,142 @@ class User:
         return self.id
 
 
-def asddbdict(instance):
-    return _base_asdict(
-        instance,
-        dict_factory=lambda tuples: {
-            key: value.isoformat() if isinstance(value, datetime) else value
-            for key, value in tuples
-        },
-    )
+def load_user(user_id: str, clear_question: bool = False) -> User:
+    """Load a user, creating it if needed, in a single update_item.
+
+    If `clear_question` is set, the pending question is removed in the same
+    call, the returned user still holds it.
+    """
+    default = User(id=user_id).to_item()
+    attributes = ["created", "balloons_updated", "balloons", "first_balloon"]
+
+    expressions = [f"{name} = if_not_exists({name}, :{name})" for name in attributes]
+    values = {f":{name}": default[name] for name in attributes}
+    if clear_question:
+        expressions.append("question = :None")
+        values[":None"] = None
+
+    item = users_table.update_item(
+        Key={"id": user_id},
+        UpdateExpression="SET " + ", ".join(expressions),
+        ExpressionAttributeValues=values,
+        ReturnValues="ALL_OLD",
+    ).get("Attributes")
+
+    # a new user has no previous attributes, moto 4 returns them empty
+    return User.from_item(item or default)
+
+
+def resolve(value):
+    """Replace the futures found in a write by their results."""
+    if isinstance(value, Future):
+        return value.result()
+    if isinstance(value, dict):
+        return {key: resolve(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve(item) for item in value]
+    return value
+
+
+class WriteBuffer:
+    """Independent writes of a request, flushed together in one call.
+
+    Puts only are sent with BatchWriteItem, as soon as an update is involved
+    all writes go in a single TransactWriteItems. Puts marked `batched` never
+    join the transaction, they are sent with BatchWriteItem in any case. Values
+    can be futures, such as the id of a message in the outbox, they are
+    resolved on flush.
+    """
+
+    def __init__(self):
+        self._writes = []
+        self._batched = []
+
+    def put(self, table: LazyTable, item: dict, batched: bool = False):
+        if batched:
+            self._batched.append(("Put", table, {"Item": item}))
+        else:
+            self._writes.append(("Put", table, {"Item": item}))
+
+    def update(self, table: LazyTable, **kwargs):
+        self._writes.append(("Update", table, kwargs))
+
+    def flush(self):
+        writes, self._writes = self._writes, []
+        batched, self._batched = self._batched, []
+        writes = [(kind, table, resolve(kwargs)) for kind, table, kwargs in writes]
+
+        if any(kind == "Update" for kind, table, kwargs in writes):
+            if len(writes) == 1:
+                kind, table, kwargs = writes[0]
+                table.update_item(**kwargs)
+            else:
+                get_dynamodb().meta.client.transact_write_items(
+                    TransactItems=[
+                        {kind: {"TableName": table.name, **kwargs}}
+                        for kind, table, kwargs in writes
+                    ]
+                )
+            writes = []
+
+        puts = writes + [
+            (kind, table, resolve(kwargs)) for kind, table, kwargs in batched
+        ]
+
+        if len(puts) == 0:
+            return
+
+        if len(puts) == 1:
+            kind, table, kwargs = puts[0]
+            return table.put_item(**kwargs)
+
+        client = get_dynamodb().meta.client
+
+        for i in range(0, len(puts), 25):
+            request_items = {}
+            for kind, table, kwargs in puts[i : i + 25]:
+                request_items.setdefault(table.name, []).append({"PutRequest": kwargs})
+
+            attempt = 0
+            while request_items:
+                if attempt > 0:
+                    time.sleep(min(0.05 * 2**attempt, 1))
+                response = client.batch_write_item(RequestItems=request_items)
+                request_items = response.get("UnprocessedItems")
+                attempt = attempt + 1
+
+
+class UserSession:
+    """Attribute changes of a user, committed as one update_item."""
+
+    def __init__(self, user: User):
+        self.user = user
+        self._changes = {}
+
+    def set(self, attribute: str, value):
+        setattr(self.user, attribute, value)
+        self._changes[attribute] = value
+
+    def commit(self):
+        if not self._changes:
+            return
+
+        changes, self._changes = self._changes, {}
+        names = {}
+        values = {}
+        for i, (attribute, value) in enumerate(changes.items()):
+            names[f"#a{i}"] = attribute
+            if hasattr(value, "to_item"):
+                value = value.to_item()
+            elif isinstance(value, datetime):
+                value = value.isoformat()
+            values[f":a{i}"] = value
+
+        users_table.update_item(
+            Key={"id": self.user.id},
+            UpdateExpression="SET "
+            + ", ".join(f"#a{i} = :a{i}" for i in range(len(changes))),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+            ConditionExpression=Attr("id").exists(),
+        )
@@ -0,0 +1,151 @@
+"""Handle Telegram updates pulled with getUpdates, instead of the webhook.
+
+    PYTHONPATH=src:. python src/polling.py --offset-file telegram.offset
+
+Updates are long polled in batches and handled over the dispatch pool, the
+updates of a chat in order. The offset of the next update is checkpointed
+to --offset-file after each batch, so a restart resumes where it stopped.
+It never moves past a failed update, which is fetched and handled again, up
+to --max-attempts times.
+Telegram refuses getUpdates while a webhook is set, see --delete-webhook.
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import time
+
+import layers.sessions
+import models
+from layers.dispatch import dispatch
+from layers.handlers import ordering_key, process
+from settings import INGEST_MAX_ATTEMPTS, TELEGRAM_API
+
+logger = logging.getLogger(__name__)
+
+
+def read_offset(path: str) -> int:
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_offset(path: str, offset: int):
+    with open(path + ".tmp", "w") as f:
+        f.write(str(offset))
+    os.replace(path + ".tmp", path)
+
+
+def get_updates(offset: int, timeout: int, limit: int) -> list:
+    res = layers.sessions.get(models.APP_TELEGRAM).post(
+        TELEGRAM_API + "getUpdates",
+        data={
+            "offset": offset,
+            "timeout": timeout,
+            "limit": limit,
+            "allowed_updates": json.dumps(["message", "callback_query"]),
+        },
+        timeout=timeout + 10,
+    )
+    res.raise_for_status()
+    return res.json()["result"]
+
+
+def as_request(update: dict) -> dict:
+    """Shape an update like the API Gateway request of its webhook."""
+    return {
+        "resource": "/telegram",
+        "headers": {},
+        "queryStringParameters": None,
+        "body": json.dumps(update),
+    }
+
+
+def handle_batch(updates: list, attempts: dict, max_attempts: int) -> int:
+    """Handle a batch of updates, return the offset of the next one to fetch.
+
+    The offset stops at the first failed update, so that it is fetched again
+    with the ones after it, which are skipped as already handled. `attempts`
+    counts the failures of each update, one failing `max_attempts` times is
+    dropped.
+    """
+    failures = dispatch(
+        [as_request(update) for update in updates],
+        key=ordering_key,
+        handle=process,
+    )
+
+    failed = []
+    for request, e in failures:
+        update_id = json.loads(request["body"])["update_id"]
+        attempts[update_id] = attempts.get(update_id, 0) + 1
+        if attempts[update_id] >= max_attempts:
+            logger.error(
+                "Dropping update %s after %s attempts", update_id, attempts[update_id]
+            )
+        else:
+            failed.append(update_id)
+
+    offset = min(failed) if failed else updates[-1]["update_id"] + 1
+    for update_id in [update_id for update_id in attempts if update_id < offset]:
+        del attempts[update_id]
+    return offset
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--offset-file", default="telegram.offset")
+    parser.add_argument("--timeout", type=int, default=30)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=INGEST_MAX_ATTEMPTS,
+        help="attempts of a failing update before it is skipped",
+    )
+    parser.add_argument(
+        "--delete-webhook",
+        action="store_true",
+        help="remove the webhook of the bot first, updates stop going to it",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.delete_webhook:
+        layers.sessions.get(models.APP_TELEGRAM).post(
+            TELEGRAM_API + "deleteWebhook"
+        ).raise_for_status()
+
+    # finish the current batch and checkpoint it on SIGTERM or SIGINT
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stopping.append(signum))
+
+    offset = read_offset(args.offset_file)
+    attempts = {}
+    while not stopping:
+        try:
+            updates = get_updates(offset, args.timeout, args.limit)
+        except Exception:
+            logger.exception("getUpdates failed")
+            time.sleep(5)
+            continue
+
+        if not updates:
+            continue
+
+        offset = handle_batch(updates, attempts, args.max_attempts)
+        write_offset(args.offset_file, offset)
+        logger.info("Handled %s updates, next offset %s", len(updates), offset)
+
+        if offset <= updates[-1]["update_id"]:
+            # failed updates are fetched again, after a pause
+            time.sleep(1)
+
+
+if __name__ == "__main__":
+    main()
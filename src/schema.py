@@ -0,0 +1,179 @@
+"""Create and migrate the DynamoDB tables described in models.TABLES.
+
+Run once per environment before deploying, e.g. :
+
+    PYTHONPATH=src:. python src/schema.py
+    PYTHONPATH=src:. python src/schema.py --check
+"""
+import argparse
+import logging
+import sys
+import time
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# seconds between two checks of an index being created
+INDEX_POLL_INTERVAL = 5
+
+
+def table_definition(
+    primary_key=("id", "S"), sort_key=None, extra_attr_def=None, **kwargs
+):
+    attr_def = [{"AttributeName": primary_key[0], "AttributeType": primary_key[1]}]
+    key_def = [{"AttributeName": primary_key[0], "KeyType": "HASH"}]
+
+    if sort_key is not None:
+        attr_def.append({"AttributeName": sort_key[0], "AttributeType": sort_key[1]})
+        key_def.append({"AttributeName": sort_key[0], "KeyType": "RANGE"})
+
+    if extra_attr_def is not None:
+        attr_def.extend(extra_attr_def)
+
+    return dict(
+        BillingMode="PAY_PER_REQUEST",
+        AttributeDefinitions=attr_def,
+        KeySchema=key_def,
+        **kwargs,
+    )
+
+
+def missing_indexes(definition, description):
+    existing = set(
+        index["IndexName"] for index in description.get("GlobalSecondaryIndexes", [])
+    )
+    return [
+        index
+        for index in definition.get("GlobalSecondaryIndexes", [])
+        if index["IndexName"] not in existing
+    ]
+
+
+def inactive_indexes(description):
+    """(name, status) of the indexes not ready to be queried yet."""
+    return [
+        (
+            index["IndexName"],
+            "BACKFILLING" if index.get("Backfilling") else index["IndexStatus"],
+        )
+        for index in description.get("GlobalSecondaryIndexes", [])
+        if index["IndexStatus"] != "ACTIVE" or index.get("Backfilling")
+    ]
+
+
+def wait_for_indexes(client, name):
+    """Wait until every index of a table is ACTIVE.
+
+    The table_exists waiter returns as soon as the table is, while a new
+    index is still being created and backfilled.
+    """
+    while True:
+        description = client.describe_table(TableName=name)["Table"]
+        inactive = inactive_indexes(description)
+        if description["TableStatus"] == "ACTIVE" and not inactive:
+            return
+        logger.info("Waiting for %s: %s", name, inactive or description["TableStatus"])
+        time.sleep(INDEX_POLL_INTERVAL)
+
+
+def migrate_ttl(client, name, ttl_attribute, check_only=False):
+    description = client.describe_time_to_live(TableName=name)["TimeToLiveDescription"]
+    if description.get("TimeToLiveStatus") in ("ENABLED", "ENABLING"):
+        return []
+
+    if check_only:
+        return [f"{name}: time to live is not enabled on {ttl_attribute}"]
+
+    logger.info("Enabling time to live on %s.%s", name, ttl_attribute)
+    client.update_time_to_live(
+        TableName=name,
+        TimeToLiveSpecification={"Enabled": True, "AttributeName": ttl_attribute},
+    )
+    return []
+
+
+def migrate(client, name, definition, ttl_attribute=None, check_only=False):
+    """Bring one table in line with its definition, return a list of problems."""
+    try:
+        description = client.describe_table(TableName=name)["Table"]
+    except client.exceptions.ResourceNotFoundException:
+        if check_only:
+            return [f"{name}: table does not exist"]
+        logger.info("Creating table %s", name)
+        client.create_table(TableName=name, **definition)
+        client.get_waiter("table_exists").wait(TableName=name)
+        wait_for_indexes(client, name)
+        if ttl_attribute is not None:
+            return migrate_ttl(client, name, ttl_attribute)
+        return []
+
+    if description["KeySchema"] != definition["KeySchema"]:
+        return [
+            f"{name}: key schema is {description['KeySchema']}, "
+            f"expected {definition['KeySchema']}"
+        ]
+
+    problems = []
+    inactive = inactive_indexes(description)
+    if check_only:
+        problems.extend(
+            f"{name}: index {index} is {status}" for index, status in inactive
+        )
+    elif inactive:
+        # an earlier run stopped while an index was being created
+        wait_for_indexes(client, name)
+
+    for index in missing_indexes(definition, description):
+        if check_only:
+            problems.append(f"{name}: missing index {index['IndexName']}")
+            continue
+        logger.info("Creating index %s on %s", index["IndexName"], name)
+        client.update_table(
+            TableName=name,
+            AttributeDefinitions=definition["AttributeDefinitions"],
+            GlobalSecondaryIndexUpdates=[{"Create": index}],
+        )
+        # one index is created at a time, and queries need it ACTIVE
+        wait_for_indexes(client, name)
+
+    if ttl_attribute is not None:
+        problems.extend(migrate_ttl(client, name, ttl_attribute, check_only))
+
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="only report differences, do not create or update anything",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    client = models.get_dynamodb().meta.client
+
+    problems = []
+    for name, spec in models.TABLES.items():
+        spec = dict(spec)
+        ttl_attribute = spec.pop("ttl_attribute", None)
+        problems.extend(
+            migrate(
+                client,
+                f"{models.prefix}{name}",
+                table_definition(**spec),
+                ttl_attribute=ttl_attribute,
+                check_only=args.check,
+            )
+        )
+
+    for problem in problems:
+        logger.error(problem)
+
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
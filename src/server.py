@@ -0,0 +1,219 @@
+"""Serve the webhooks over HTTP, without API Gateway and Lambda.
+
+    PYTHONPATH=src:. python src/server.py --port 8080 --workers 4 --threads 16
+
+Requests to /telegram and /facebook-messenger are translated into the API
+Gateway proxy event layers.handlers.handle expects, and GET /health answers
+200. The listening socket is opened once and shared by --workers forked
+processes, each handling up to --threads requests at a time and keeping its
+own warm tables, HTTP sessions and caches. SIGTERM or SIGINT stop accepting
+requests, let the ones in flight finish and exit. If a worker dies, the
+others are stopped the same way and the server exits with its status, for
+the supervisor to restart it.
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+from layers.handlers import handle
+
+logger = logging.getLogger(__name__)
+
+ROUTES = ("/telegram", "/facebook-messenger")
+
+
+def as_request(method: str, url: str, headers, body: str) -> dict:
+    """Shape an HTTP request like the API Gateway proxy event of its route."""
+    url = urlparse(url)
+    query = dict(parse_qsl(url.query))
+    return {
+        "resource": url.path,
+        "path": url.path,
+        "httpMethod": method,
+        # "x-hub-signature" and "X-Hub-Signature" are the same header
+        "headers": {key.title(): value for key, value in headers.items()},
+        "queryStringParameters": query or None,
+        "body": body,
+    }
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    # connections are closed after each response, so that idle keep-alive
+    # connections do not hold the threads of the pool
+    timeout = 30
+
+    def respond(self, status: int, body=None, headers=None):
+        body = (body or "").encode()
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_webhook(self, method):
+        path = urlparse(self.path).path
+        if path not in ROUTES:
+            return self.respond(404)
+
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode() if length else None
+
+        try:
+            response = handle(as_request(method, self.path, self.headers, body))
+        except Exception:
+            logger.exception("Failed to handle %s %s", method, path)
+            return self.respond(500)
+
+        self.respond(
+            response["statusCode"], response.get("body"), response.get("headers")
+        )
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            return self.respond(
+                200,
+                json.dumps({"status": "ok", "pid": os.getpid()}),
+                {"Content-Type": "application/json"},
+            )
+        # Messenger webhook subscription
+        self.handle_webhook("GET")
+
+    def do_POST(self):
+        self.handle_webhook("POST")
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTP server handling requests over a bounded pool of threads.
+
+    The pool is created on first request, in the worker process, since threads
+    do not survive a fork.
+    """
+
+    def __init__(self, address, threads: int):
+        super().__init__(address, WebhookRequestHandler)
+        self.threads = threads
+        self.executor = None
+
+    def process_request(self, request, client_address):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self):
+        """Stop accepting requests and wait for the ones in flight."""
+        self.shutdown()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.server_close()
+
+
+def serve(server: PooledHTTPServer, drain_queue: bool = False):
+    """Serve until SIGTERM or SIGINT, in the current process."""
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stop.set())
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    if drain_queue:
+        import worker
+
+        def drain():
+            while not stop.is_set():
+                if worker.drain() == 0:
+                    stop.wait(1)
+
+        threading.Thread(target=drain, daemon=True).start()
+
+    logger.info("Worker %s listening on %s:%s", os.getpid(), *server.server_address)
+    stop.wait()
+    server.drain()
+    logger.info("Worker %s stopped", os.getpid())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument(
+        "--drain",
+        action="store_true",
+        help="in ingest mode, also handle the queued requests in every worker",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    server = PooledHTTPServer((args.host, args.port), args.threads)
+
+    if args.workers == 1:
+        serve(server, args.drain)
+        return 0
+
+    children = set()
+    for i in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            # the child never returns into the fork loop of the parent
+            status = 1
+            try:
+                serve(server, args.drain)
+                status = 0
+            except BaseException:
+                logger.exception("Worker %s failed", os.getpid())
+            finally:
+                logging.shutdown()
+                os._exit(status)
+        children.add(pid)
+
+    # the parent only forwards stop signals and waits for the workers
+    server.socket.close()
+
+    def stop(signum=None, frame=None):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, stop)
+
+    # reap every worker, and stop them all as soon as one of them dies
+    status = 0
+    while children:
+        pid, wait_status = os.wait()
+        children.discard(pid)
+        if os.WIFSIGNALED(wait_status):
+            code = 128 + os.WTERMSIG(wait_status)
+        else:
+            code = os.WEXITSTATUS(wait_status)
+        if code and not status:
+            logger.error("Worker %s exited with %s, stopping the others", pid, code)
+            stop()
+        status = status or code
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -19,5 +19,82 @@ TELEGRAM_TOKEN = env("TELEGRAM_TOKEN")
 TELEGRAM_API = "https://api.telegram.org/bot" + TELEGRAM_TOKEN + "/"
 TABLE_PREFIX = "helium_dev_" if DEV else "helium_prod_"
 
+# number of hosts kept alive, and of connections kept per host, per platform
+HTTP_POOL_CONNECTIONS = int(env("HTTP_POOL_CONNECTIONS", 4))
+HTTP_POOL_MAXSIZE = int(env("HTTP_POOL_MAXSIZE", 10))
+
+# Messenger display names, in seconds : in-process cache, then users table
+DISPLAY_NAME_CACHE_SIZE = int(env("DISPLAY_NAME_CACHE_SIZE", 4096))
+DISPLAY_NAME_CACHE_TTL = int(env("DISPLAY_NAME_CACHE_TTL", 3600))
+DISPLAY_NAME_TTL = int(env("DISPLAY_NAME_TTL", 7 * 24 * 3600))
+
+# worker threads processing the events of a batched webhook delivery
+DISPATCH_WORKERS = int(env("DISPATCH_WORKERS", 8))
+
+# worker threads sending the replies of a request to several Telegram chats
+OUTBOX_WORKERS = int(env("OUTBOX_WORKERS", 4))
+
+# worker threads running the requests of layers.handlers.handle_async
+BLOCKING_WORKERS = int(env("BLOCKING_WORKERS", 32))
+
+# worker threads running non-essential side effects (mark seen, ...)
+DEFERRED_WORKERS = int(env("DEFERRED_WORKERS", 4))
+
+# per-request traces of DynamoDB and HTTP calls, logged as one JSON line
+TRACING = env("TRACING", "true").lower() == "true"
+
+# send the last reply to a Telegram update as the webhook response
+TELEGRAM_WEBHOOK_REPLY = env("TELEGRAM_WEBHOOK_REPLY", "false").lower() == "true"
+
+# worker threads running the queries of models.query_many
+QUERY_WORKERS = int(env("QUERY_WORKERS", 8))
+
+# trending tags : days taken into account, daily decay and number displayed,
+# combinations kept per day in the top item, and seconds a process caches it
+TRENDING_DAYS = int(env("TRENDING_DAYS", 7))
+TRENDING_DECAY = env("TRENDING_DECAY", "0.5")
+TRENDING_TOP_K = int(env("TRENDING_TOP_K", 10))
+TRENDING_KEPT = int(env("TRENDING_KEPT", 3 * TRENDING_TOP_K))
+TRENDING_CACHE_TTL = int(env("TRENDING_CACHE_TTL", 10))
+# seconds a process waits before rewriting the count of a ranked combination
+# in the top item again, the ranking lags by as much
+TRENDING_REFRESH_INTERVAL = int(env("TRENDING_REFRESH_INTERVAL", 10))
+
+# shard counts of hot tags ("world=4,fr=2"), and how long, in seconds, a count
+# learned from the counters is trusted
+SHARDED_TAGS = env("SHARDED_TAGS", "")
+SHARDS_CACHE_TTL = int(env("SHARDS_CACHE_TTL", 300))
+
+# long button commands stored in the callbacks table, in seconds
+CALLBACK_TTL = int(env("CALLBACK_TTL", 30 * 24 * 3600))
+CALLBACK_CACHE_SIZE = int(env("CALLBACK_CACHE_SIZE", 4096))
+CALLBACK_CACHE_TTL = int(env("CALLBACK_CACHE_TTL", 3600))
+CALLBACK_MISSING_TTL = int(env("CALLBACK_MISSING_TTL", 60))
+
+# ingest mode: webhooks are validated, queued and acknowledged at once, and
+# handled by src/worker.py. "memory", "sqlite:<path>" or an SQS queue url,
+# empty to handle webhooks inline
+INGEST_QUEUE = env("INGEST_QUEUE", "")
+INGEST_BATCH_SIZE = int(env("INGEST_BATCH_SIZE", 10))
+INGEST_CONCURRENCY = int(env("INGEST_CONCURRENCY", 8))
+# attempts of a queued request, and seconds it stays hidden while handled
+INGEST_MAX_ATTEMPTS = int(env("INGEST_MAX_ATTEMPTS", 3))
+INGEST_VISIBILITY_TIMEOUT = int(env("INGEST_VISIBILITY_TIMEOUT", 60))
+
+# platform updates already handled, remembered for DEDUP_TTL seconds
+DEDUP_TTL = int(env("DEDUP_TTL", 24 * 3600))
+DEDUP_CACHE_SIZE = int(env("DEDUP_CACHE_SIZE", 8192))
+
+# tags combinations indexed by tag, kept for TAG_INDEX_TTL seconds after their
+# last balloon, and how many recent combinations are read per tag on fallback
+TAG_INDEX_TTL = int(env("TAG_INDEX_TTL", 30 * 24 * 3600))
+TAG_INDEX_CANDIDATES = int(env("TAG_INDEX_CANDIDATES", 20))
+# tags of a combination indexed at most, the others are not found by fallback
+TAG_INDEX_MAX_TAGS = int(env("TAG_INDEX_MAX_TAGS", 10))
+
+# platform payload of stored balloons: "compressed" (zlib JSON in raw_z),
+# "full" (raw map, as before) or "drop"
+BALLOON_RAW = env("BALLOON_RAW", "compressed")
+
 if DEV:
     logging.basicConfig(level=logging.DEBUG)
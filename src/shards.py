@@ -0,0 +1,59 @@
+"""Sharded sequence counters for hot tags.
+
+A tags combination with N shards has N counters and N balloon partitions.
+Shard 0 uses the tags as key, so unsharded tags are unchanged, shard i uses
+"<tags>\\t<i>" (tags never contain whitespace). A balloon is paired with the
+previous balloon of its own shard.
+
+Shard counts come from the SHARDED_TAGS setting ("world=4,fr=2") and can be
+changed at runtime with :
+
+    PYTHONPATH=src:. python src/shards.py world 8
+
+which stores the count on the shard 0 counter. Processes learn it from the
+counter the next time they write to shard 0.
+"""
+import random
+import sys
+
+import models
+from layers.cache import TTLCache
+from settings import SHARDED_TAGS, SHARDS_CACHE_TTL
+
+SEPARATOR = "\t"
+
+configured = {
+    tags: int(count)
+    for tags, count in (
+        part.rsplit("=", 1) for part in SHARDED_TAGS.split(",") if "=" in part
+    )
+}
+learned = TTLCache(maxsize=1024, ttl=SHARDS_CACHE_TTL)
+
+
+def count(tags: str) -> int:
+    return learned.get(tags) or configured.get(tags, 1)
+
+
+def learn(tags: str, shards):
+    learned.set(tags, int(shards))
+
+
+def pick(tags: str) -> int:
+    return random.randrange(count(tags))
+
+
+def partition(tags: str, shard: int) -> str:
+    return tags if shard == 0 else f"{tags}{SEPARATOR}{shard}"
+
+
+def promote(tags: str, shards: int):
+    models.balloons_seq_table.update_item(
+        Key={"tags": tags},
+        UpdateExpression="SET shards = :shards",
+        ExpressionAttributeValues={":shards": shards},
+    )
+
+
+if __name__ == "__main__":
+    promote(sys.argv[1], int(sys.argv[2]))
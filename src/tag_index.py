@@ -0,0 +1,95 @@
+"""Inverted index from single tags to the tags combinations they appear in.
+
+Every balloon puts one tag_index item per tag of its combination, for up to
+TAG_INDEX_MAX_TAGS tags, keyed by (tag, tags) and holding the time of the last
+balloon. They are batched apart from the transaction of the request. When a
+combination has no previous balloon, the most recent combinations of each of
+its tags are read from the last_message index, and the balloon is paired with
+the last balloon of the one sharing the most tags.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+from boto3.dynamodb.conditions import Key
+
+import models
+import shards
+from settings import TAG_INDEX_CANDIDATES, TAG_INDEX_MAX_TAGS, TAG_INDEX_TTL
+
+# counters read for the best candidates, in one BatchGetItem
+COUNTERS_READ = 5
+
+
+def record(writes: models.WriteBuffer, tags: str, when: str):
+    if tags == "world":
+        return
+
+    expires = int(
+        (datetime.fromisoformat(when) + timedelta(seconds=TAG_INDEX_TTL)).timestamp()
+    )
+    for tag in tags.split(" ")[:TAG_INDEX_MAX_TAGS]:
+        writes.put(
+            models.tag_index_table,
+            {"tag": tag, "tags": tags, "last_message": when, "expires": expires},
+            batched=True,
+        )
+
+
+def candidates(tags: str) -> list:
+    """Recent combinations sharing tags with `tags`, best overlap first."""
+    # only the indexed tags can match
+    wanted = set(tags.split(" ")[:TAG_INDEX_MAX_TAGS])
+    found = {}
+    for item in models.query_many(
+        models.tag_index_table,
+        [
+            dict(
+                IndexName="last_message",
+                KeyConditionExpression=Key("tag").eq(tag),
+                ScanIndexForward=False,
+                Limit=TAG_INDEX_CANDIDATES,
+            )
+            for tag in wanted
+        ],
+        max_pages=1,
+    ):
+        found[item["tags"]] = max(found.get(item["tags"], ""), item["last_message"])
+
+    return sorted(
+        found,
+        key=lambda combination: (
+            len(wanted & set(combination.split(" "))),
+            found[combination],
+        ),
+        reverse=True,
+    )
+
+
+def find_balloon(tags: str, user_id: str) -> Optional[dict]:
+    """Last balloon, with its seq, of the best combination overlapping `tags`.
+
+    Balloons sent by `user_id` are skipped, None is returned if there is no
+    other balloon to pair with.
+    """
+    if tags == "world":
+        return None
+
+    best = candidates(tags)[:COUNTERS_READ]
+    if not best:
+        return None
+
+    partitions = {
+        shards.partition(combination, shards.pick(combination)): rank
+        for rank, combination in enumerate(best)
+    }
+    table = models.balloons_seq_table.name
+    counters = models.get_dynamodb().batch_get_item(
+        RequestItems={table: {"Keys": [{"tags": key} for key in partitions]}}
+    )["Responses"][table]
+
+    for counter in sorted(counters, key=lambda counter: partitions[counter["tags"]]):
+        balloon = counter.get("last_balloon")
+        if balloon is not None and balloon["user_id"] != user_id:
+            return {**balloon, "seq": counter["seq"]}
+
+    return None
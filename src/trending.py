@@ -0,0 +1,158 @@
+import logging
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+
+import models
+from layers.cache import TTLCache
+from settings import (
+    TRENDING_CACHE_TTL,
+    TRENDING_DAYS,
+    TRENDING_DECAY,
+    TRENDING_KEPT,
+    TRENDING_REFRESH_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+# Each (day, tags) combination has its own counter item in trending_table, so
+# that no item grows with traffic. The "top" item holds, for each of the last
+# TRENDING_DAYS days, the TRENDING_KEPT combinations counted most that day, by
+# their display form ("#fr #music"). Writers promote their count into it with
+# conditional updates, and reading the trending tags is a single GetItem. A
+# ranked count is rewritten at most once per TRENDING_REFRESH_INTERVAL by each
+# process, so that busy combinations do not all write the top item.
+TOP_KEY = {"id": "top"}
+PROMOTE_ATTEMPTS = 3
+
+top_cache = TTLCache(maxsize=1, ttl=TRENDING_CACHE_TTL)
+refreshed = TTLCache(maxsize=4 * TRENDING_KEPT, ttl=TRENDING_REFRESH_INTERVAL)
+
+
+def display(tags):
+    return "#" + tags.replace(" ", " #")
+
+
+def is_conflict(e: ClientError) -> bool:
+    return e.response["Error"]["Code"] == "ConditionalCheckFailedException"
+
+
+def record(tags: str, when: datetime):
+    if tags == "world":
+        return
+
+    day = when.date().isoformat()
+    expires = when + timedelta(days=TRENDING_DAYS + 1)
+    count = models.trending_table.update_item(
+        Key={"id": f"{day} {tags}"},
+        UpdateExpression="ADD #count :1 SET expires = if_not_exists(expires, :expires)",
+        ExpressionAttributeNames={"#count": "count"},
+        ExpressionAttributeValues={":1": 1, ":expires": int(expires.timestamp())},
+        ReturnValues="UPDATED_NEW",
+    )["Attributes"]["count"]
+
+    promote(day, display(tags), count)
+
+
+def get_top(consistent: bool = False) -> dict:
+    if not consistent:
+        top = top_cache.get("top")
+        if top is not None:
+            return top
+
+    top = models.trending_table.get_item(Key=TOP_KEY, ConsistentRead=consistent).get(
+        "Item", {}
+    )
+    top_cache.set("top", top)
+    return top
+
+
+def promote(day: str, tags: str, count: int):
+    """Bring the count of `tags` on `day` into the top item, if it ranks."""
+    top = get_top()
+    for attempt in range(PROMOTE_ATTEMPTS):
+        entries = top.get("days", {}).get(day, {})
+
+        if tags in entries:
+            if entries[tags] >= count or (day, tags) in refreshed:
+                return
+            # already ranked, only its count changes
+            try:
+                models.trending_table.update_item(
+                    Key=TOP_KEY,
+                    UpdateExpression="SET days.#day.#tags = :count ADD version :1",
+                    ConditionExpression="days.#day.#tags < :count",
+                    ExpressionAttributeNames={"#day": day, "#tags": tags},
+                    ExpressionAttributeValues={":count": count, ":1": 1},
+                )
+            except ClientError as e:
+                if not is_conflict(e):
+                    raise e
+                top = get_top(consistent=True)
+                continue
+            entries[tags] = count
+            refreshed.set((day, tags), True)
+            return
+
+        if len(entries) >= TRENDING_KEPT and count <= min(entries.values()):
+            return
+
+        # ranks for the first time: rewrite the days, dropping the lowest
+        # count and the days out of the window, if nobody wrote in between
+        entries = {**entries, tags: count}
+        while len(entries) > TRENDING_KEPT:
+            del entries[min(entries, key=entries.get)]
+        oldest = (
+            date.fromisoformat(day) - timedelta(days=TRENDING_DAYS - 1)
+        ).isoformat()
+        days = {
+            other: other_entries
+            for other, other_entries in top.get("days", {}).items()
+            if oldest <= other < day
+        }
+        days[day] = entries
+
+        version = top.get("version", 0)
+        values = {":days": days, ":version": version + 1}
+        if version:
+            condition = "version = :previous"
+            values[":previous"] = version
+        else:
+            condition = "attribute_not_exists(version)"
+        try:
+            models.trending_table.update_item(
+                Key=TOP_KEY,
+                UpdateExpression="SET days = :days, version = :version",
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values,
+            )
+        except ClientError as e:
+            if not is_conflict(e):
+                raise e
+            top = get_top(consistent=True)
+            continue
+
+        top_cache.set("top", {**top, "days": days, "version": version + 1})
+        refreshed.set((day, tags), True)
+        return
+
+    logger.warning(
+        "Gave up promoting %s on %s after %s attempts", tags, day, attempt + 1
+    )
+
+
+def top(k: int):
+    """Return the k most trending tags combinations, as (display, score)."""
+    today = datetime.now(timezone.utc).date()
+    days = [(today - timedelta(days=i)).isoformat() for i in range(TRENDING_DAYS)]
+
+    scores = {}
+    for day, entries in get_top().get("days", {}).items():
+        if day not in days:
+            continue
+        weight = Decimal(TRENDING_DECAY) ** days.index(day)
+        for tags, count in entries.items():
+            scores[tags] = scores.get(tags, 0) + count * weight
+
+    return sorted(scores.items(), key=lambda score: score[1], reverse=True)[:k]
@@ -0,0 +1,84 @@
+"""Handle the requests queued by the webhooks in ingest mode.
+
+    PYTHONPATH=src:. python src/worker.py
+
+drains INGEST_QUEUE forever, INGEST_BATCH_SIZE requests at a time over
+INGEST_CONCURRENCY threads. With an SQS queue, `lambda_handler` is the entry
+point of the worker function, subscribed to the queue.
+"""
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from layers import ingest
+from layers.dispatch import dispatch
+from layers.handlers import ordering_key, process
+from settings import INGEST_BATCH_SIZE, INGEST_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=INGEST_CONCURRENCY)
+
+
+def run_batch(batch: List[tuple]) -> list:
+    """Process a batch of (receipt, request), return the failed receipts.
+
+    Requests of the same chat are handled in order, the others concurrently.
+    """
+    failures = dispatch(
+        batch,
+        key=lambda item: ordering_key(item[1]),
+        handle=lambda item: process(item[1]),
+        executor=_executor,
+    )
+    return [item[0] for item, e in failures]
+
+
+def drain(queue: ingest.BaseQueue = None) -> int:
+    """Process queued requests until the queue is empty, return their count."""
+    queue = queue or ingest.get_queue()
+    done = 0
+    while True:
+        batch = queue.take(INGEST_BATCH_SIZE)
+        if not batch:
+            return done
+
+        failed = run_batch(batch)
+        queue.ack(
+            [
+                receipt
+                for receipt, request in batch
+                if not any(receipt is failure for failure in failed)
+            ]
+        )
+        for receipt in failed:
+            queue.release(receipt)
+        done = done + len(batch)
+
+
+def lambda_handler(event, context):
+    """Entry point of the SQS event source.
+
+    Failed messages are reported back, to be retried according to the redrive
+    policy of the queue.
+    """
+    failed = run_batch(
+        [
+            (record["messageId"], json.loads(record["body"]))
+            for record in event["Records"]
+        ]
+    )
+    return {"batchItemFailures": [{"itemIdentifier": receipt} for receipt in failed]}
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    while True:
+        if drain() == 0:
+            time.sleep(1)
+
+
+if __name__ == "__main__":
+    main()